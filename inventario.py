@@ -12,28 +12,53 @@ CARACTERÍSTICAS:
 - Export Excel multi-hoja
 
 DEPENDENCIAS:
-pip install customtkinter mysql-connector-python pandas openpyxl
+pip install customtkinter mysql-connector-python pandas python-calamine openpyxl xlsxwriter
 """
 
+from __future__ import annotations
+
+import atexit
+import copy
+import csv
 import json
 import logging
 import os
+import queue
 import sys
 import threading
+import math
+import tempfile
 import time
-import winsound
+import wave
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+from itertools import repeat
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from tkinter import filedialog, messagebox
-from typing import Any, Dict, List, Tuple
+from tkinter import TclError, filedialog, messagebox, ttk
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 
 import customtkinter as ctk
 import mysql.connector
-import pandas as pd
 from mysql.connector import Error, pooling
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import winsound
+except ImportError:  # Solo disponible en Windows
+    winsound = None
+
+# pandas/xlsxwriter se importan de forma diferida (solo al usar Excel)
+if TYPE_CHECKING:
+    import pandas as pd
 
 # ============================================================================
 # CONFIGURACIÓN DE LOGGING
@@ -41,14 +66,23 @@ from openpyxl.styles import PatternFill
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
+# Los registros se encolan y un hilo aparte escribe a archivo/consola
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(
+    _log_queue,
+    logging.FileHandler(LOG_DIR / f"inventario_{datetime.now().strftime('%Y%m%d')}.log"),
+    logging.StreamHandler()
+)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_DIR / f"inventario_{datetime.now().strftime('%Y%m%d')}.log"),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(_log_queue)]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.getLogger('mysql.connector').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # ============================================================================
@@ -69,6 +103,26 @@ class Colors:
     CONSOLE = "#000000"
 
 
+class Fonts:
+    """Fuentes compartidas: se crean una sola vez con Fonts.iniciar() tras crear la ventana raíz"""
+    _DEFINICIONES = {
+        'BOLD_20': (20, "bold"),
+        'BOLD_18': (18, "bold"),
+        'BOLD_14': (14, "bold"),
+        'BOLD_13': (13, "bold"),
+        'BOLD_12': (12, "bold"),
+        'NORMAL_14': (14, "normal"),
+        'NORMAL_13': (13, "normal"),
+        'NORMAL_11': (11, "normal"),
+        'NORMAL_10': (10, "normal"),
+    }
+    
+    @classmethod
+    def iniciar(cls):
+        for nombre, (size, weight) in cls._DEFINICIONES.items():
+            setattr(cls, nombre, ctk.CTkFont(family="Arial", size=size, weight=weight))
+
+
 # ============================================================================
 # GESTOR DE CONFIGURACIÓN
 # ============================================================================
@@ -92,30 +146,61 @@ class ConfigManager:
         }
     }
     
+    # Cache del último archivo leído (se invalida si cambia el mtime)
+    _cache = None
+    _cache_mtime = None
+    
     @classmethod
     def load(cls) -> Dict[str, Any]:
+        """Configuración actual. Cada llamador recibe su propia copia: modificarla no
+        afecta a los demás ni a la cache hasta que se guarde con save()."""
         try:
             if cls.CONFIG_FILE.exists():
-                with open(cls.CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    logger.info("Configuración cargada")
-                    return config
+                mtime = cls.CONFIG_FILE.stat().st_mtime_ns
+                if cls._cache is not None and mtime == cls._cache_mtime:
+                    return copy.deepcopy(cls._cache)
+                
+                with open(cls.CONFIG_FILE, 'rb') as f:
+                    data = f.read()
+                config = orjson.loads(data) if orjson else json.loads(data)
+                cls._cache, cls._cache_mtime = config, mtime
+                logger.info("Configuración cargada")
+                return copy.deepcopy(config)
             else:
                 cls.save(cls.DEFAULT_CONFIG)
                 logger.warning("Config creado por defecto")
-                return cls.DEFAULT_CONFIG
+                return copy.deepcopy(cls.DEFAULT_CONFIG)
         except Exception as e:
-            logger.error(f"Error config: {e}")
-            return cls.DEFAULT_CONFIG
+            logger.error("Error config: %s", e)
+            return copy.deepcopy(cls.DEFAULT_CONFIG)
     
     @classmethod
     def save(cls, config: Dict[str, Any]) -> bool:
         try:
-            with open(cls.CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4)
+            if orjson:
+                data = orjson.dumps(config, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps(config, indent=4).encode('utf-8')
+            
+            # Escritura atómica: archivo temporal en el mismo directorio + os.replace
+            destino = cls.CONFIG_FILE.resolve()
+            fd, tmp = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=destino.parent)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, destino)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            
+            # El contenido escrito es válido: queda en cache (copia propia) sin releer el archivo
+            cls._cache = copy.deepcopy(config)
+            cls._cache_mtime = destino.stat().st_mtime_ns
             return True
         except Exception as e:
-            logger.error(f"Error guardando config: {e}")
+            logger.error("Error guardando config: %s", e)
             return False
 
 
@@ -123,10 +208,51 @@ class ConfigManager:
 # GESTOR DE BASE DE DATOS
 # ============================================================================
 class DBManager:
+    # Consultas del ciclo de sincronización que se lanzan en paralelo (ancho de su executor)
+    CONSULTAS_SYNC = 3
+    # Conexiones que la app puede tener en uso a la vez: consultas del sync + su hilo de ciclo,
+    # escritor de conteos, búsqueda general y filtro de cada pestaña, exportación o
+    # actualización de stock, y el hilo de UI. Un pool_size menor en config.json se eleva a esto.
+    POOL_MIN = CONSULTAS_SYNC + 1 + 1 + 3 + 1 + 1
+    # Segundos que se espera una conexión libre antes de dar el pool por agotado
+    ESPERA_POOL = 5.0
+    MAX_FILAS_LOTE = 5000
+    # A partir de cuántas filas se intenta LOAD DATA LOCAL INFILE
+    UMBRAL_LOAD_DATA = 5000
+    CARGA_DIR = Path(tempfile.gettempdir()) / "inventario_carga"
+    SESSION_INIT_SQL = "SET SESSION transaction_isolation = 'READ-COMMITTED'"
+    # Sentencias preparadas que se conservan por conexión
+    MAX_PREPARADAS = 32
+    
+    # Consultas del ciclo de escaneo (texto fijo: se preparan una vez por conexión)
+    COLUMNAS_ITEM = ('codigo', 'producto', 'linea', 'stock_sistema', 'conteo_fisico',
+                     'ultimo_equipo_id', 'fecha_conteo', 'novedad', 'nombre_equipo')
+    SQL_ITEM = """SELECT i.codigo, i.producto, i.linea, i.stock_sistema, i.conteo_fisico, 
+                         i.ultimo_equipo_id, i.fecha_conteo, i.novedad, e.nombre_equipo 
+                  FROM items_corte i 
+                  LEFT JOIN equipos e ON i.ultimo_equipo_id=e.id 
+                  WHERE i.sesion_id=%s AND i.codigo=%s"""
+    SQL_CONTEO_ITEM = """UPDATE items_corte 
+                         SET conteo_fisico=%s, novedad=%s, fecha_conteo=NOW(), ultimo_equipo_id=%s 
+                         WHERE sesion_id=%s AND codigo=%s"""
+    SQL_CONTEO_HISTORIAL = """INSERT INTO historial_movimientos 
+                              (sesion_id, item_codigo, equipo_id, tipo_accion,
+                               cantidad_anterior, cantidad_resultante, fecha_movimiento) 
+                              SELECT %s, %s, %s, %s, %s, %s, fecha_conteo 
+                              FROM items_corte WHERE sesion_id=%s AND codigo=%s"""
+    
+    # Tablas de datos (hijas primero) y FKs que CREATE TABLE ... LIKE no copia
+    TABLAS_DATOS = ('historial_movimientos', 'items_corte', 'equipos', 'sesiones')
+    _FKS_TABLAS = {
+        'items_corte': "FOREIGN KEY (sesion_id) REFERENCES sesiones(id) ON DELETE CASCADE",
+        'historial_movimientos': "FOREIGN KEY (sesion_id) REFERENCES sesiones(id) ON DELETE CASCADE",
+    }
+    
     def __init__(self):
         self.config = ConfigManager.load()
         self.db_config = self.config['database']
         self.connection_pool = None
+        self._max_packet = None
         self._initialize_database()
         self._initialize_pool()
     
@@ -145,45 +271,123 @@ class DBManager:
                 f"CREATE DATABASE IF NOT EXISTS {self.db_config['database']} "
                 f"CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
             )
-            logger.info(f"BD '{self.db_config['database']}' OK")
+            logger.info("BD '%s' OK", self.db_config['database'])
             cursor.close()
             conn.close()
         except Error as e:
-            logger.error(f"Error creando BD: {e}")
+            logger.error("Error creando BD: %s", e)
             raise
     
     def _initialize_pool(self):
         try:
+            pool_size = self.db_config.get('pool_size', 10)
+            if pool_size < self.POOL_MIN:
+                logger.warning("pool_size=%s es menor que las conexiones concurrentes de la app; se usa %s",
+                               pool_size, self.POOL_MIN)
+                pool_size = self.POOL_MIN
+            
             pool_config = {
                 'host': self.db_config['host'],
                 'port': self.db_config.get('port', 3306),
                 'user': self.db_config['user'],
                 'password': self.db_config['password'],
                 'database': self.db_config['database'],
-                'pool_size': self.db_config.get('pool_size', 10),
-                'pool_name': self.db_config.get('pool_name', 'inventario_pool')
+                'pool_size': pool_size,
+                'pool_name': self.db_config.get('pool_name', 'inventario_pool'),
+                # SET NAMES una sola vez al conectar y driver en C
+                'charset': 'utf8mb4',
+                'collation': 'utf8mb4_unicode_ci',
+                'use_pure': False,
+                # Sin paquete de reset en cada préstamo: la sesión se configura una vez
+                'pool_reset_session': False,
+                # LOAD DATA LOCAL solo desde el directorio de cargas temporales
+                'allow_local_infile_in_path': str(self.CARGA_DIR)
             }
             
+            self.CARGA_DIR.mkdir(exist_ok=True)
             self.connection_pool = pooling.MySQLConnectionPool(**pool_config)
             logger.info("Pool OK")
             self._create_tables()
         except Error as e:
-            logger.error(f"Error pool: {e}")
+            logger.error("Error pool: %s", e)
             raise
     
+    def _configurar_sesion(self, conn):
+        """Aplica las variables de sesión solo a conexiones nuevas o reconectadas"""
+        cnx = getattr(conn, '_cnx', conn)
+        if getattr(cnx, '_sesion_configurada', None) == conn.connection_id:
+            return
+        
+        cursor = conn.cursor()
+        cursor.execute(self.SESSION_INIT_SQL)
+        cursor.close()
+        cnx._sesion_configurada = conn.connection_id
+    
+    def marcar_sesion_alterada(self, conn):
+        """Pide restablecer la sesión al devolver la conexión al pool.
+        
+        El pool no resetea la sesión en cada préstamo (las sentencias preparadas viven en ella);
+        quien cambie variables de sesión o cree tablas temporales debe marcar la conexión.
+        """
+        getattr(conn, '_cnx', conn)._sesion_alterada = True
+    
+    def _restablecer_sesion(self, conn):
+        """COM_RESET_CONNECTION: vuelve variables y tablas temporales al estado inicial"""
+        cnx = getattr(conn, '_cnx', conn)
+        cnx._sesion_alterada = False
+        # El reset también libera las sentencias preparadas del servidor: descartar la cache
+        cache = getattr(cnx, '_preparadas', None)
+        cnx._preparadas = None
+        cnx._sesion_configurada = None
+        if cache:
+            for cursor in cache[1].values():
+                try:
+                    cursor.close()
+                except Error:
+                    pass
+        try:
+            conn.cmd_reset_connection()
+        except Error as e:
+            # Sin reset posible, cerrar la conexión física: el pool abre una limpia
+            logger.warning("No se pudo restablecer la sesión (%s); se descarta la conexión", e)
+            conn.disconnect()
+    
+    def _tomar_conexion(self):
+        """Conexión del pool; si está agotado espera hasta ESPERA_POOL en lugar de fallar al instante"""
+        limite = time.monotonic() + self.ESPERA_POOL
+        while True:
+            try:
+                return self.connection_pool.get_connection()
+            except pooling.PoolError:
+                if time.monotonic() >= limite:
+                    raise
+                time.sleep(0.05)
+    
     @contextmanager
     def get_connection(self):
         conn = None
         try:
-            conn = self.connection_pool.get_connection()
+            conn = self._tomar_conexion()
+            self._configurar_sesion(conn)
             yield conn
         except Error as e:
-            logger.error(f"Error conexión: {e}")
+            logger.error("Error conexión: %s", e)
             if conn:
                 conn.rollback()
             raise
         finally:
-            if conn and conn.is_connected():
+            if conn:
+                if conn.is_connected():
+                    # Sin reset de sesión, cerrar cualquier transacción de lectura abierta
+                    try:
+                        if conn.in_transaction:
+                            conn.rollback()
+                    except Error:
+                        pass
+                    # ... y deshacer lo que el llamador haya cambiado en la sesión
+                    if getattr(getattr(conn, '_cnx', conn), '_sesion_alterada', False):
+                        self._restablecer_sesion(conn)
+                # Devolverla siempre al pool: una conexión descartada se reabre en el próximo préstamo
                 conn.close()
     
     def _create_tables(self):
@@ -218,8 +422,9 @@ class DBManager:
                     fecha_conteo DATETIME,
                     ultimo_equipo_id INT,
                     FOREIGN KEY (sesion_id) REFERENCES sesiones(id) ON DELETE CASCADE,
-                    INDEX idx_sesion_codigo (sesion_id, codigo),
-                    INDEX idx_linea (linea)
+                    UNIQUE KEY uk_sesion_codigo (sesion_id, codigo),
+                    INDEX idx_sesion_linea (sesion_id, linea),
+                    INDEX idx_items_sync (sesion_id, stock_sistema, linea, conteo_fisico)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             """)
             
@@ -231,7 +436,7 @@ class DBManager:
                     integrantes TEXT,
                     activo BOOLEAN DEFAULT 1,
                     fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_activo (activo)
+                    INDEX idx_activo_nombre (activo, nombre_equipo)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             """)
             
@@ -249,6 +454,99 @@ class DBManager:
                 cursor.execute("ALTER TABLE equipos ADD COLUMN integrantes TEXT AFTER nombre_equipo")
                 logger.info("Columna integrantes agregada a tabla equipos")
             
+            # Índice compuesto para "WHERE activo=1 ORDER BY nombre_equipo" (reemplaza idx_activo)
+            cursor.execute("""
+                SELECT DISTINCT INDEX_NAME 
+                FROM information_schema.STATISTICS 
+                WHERE TABLE_SCHEMA = DATABASE() 
+                AND TABLE_NAME = 'equipos' 
+                AND INDEX_NAME IN ('idx_activo', 'idx_activo_nombre')
+            """)
+            
+            indices = {fila[0] for fila in cursor.fetchall()}
+            if 'idx_activo_nombre' not in indices:
+                alter = "ALTER TABLE equipos ADD INDEX idx_activo_nombre (activo, nombre_equipo)"
+                if 'idx_activo' in indices:
+                    alter += ", DROP INDEX idx_activo"
+                cursor.execute(alter)
+                logger.info("Índice idx_activo_nombre agregado a equipos")
+            
+            # Migrar índice (sesion_id, codigo) a UNIQUE si la tabla es anterior
+            cursor.execute("""
+                SELECT COUNT(*) as existe 
+                FROM information_schema.STATISTICS 
+                WHERE TABLE_SCHEMA = DATABASE() 
+                AND TABLE_NAME = 'items_corte' 
+                AND INDEX_NAME = 'uk_sesion_codigo'
+            """)
+            
+            if cursor.fetchone()[0] == 0:
+                cursor.execute("""
+                    SELECT COUNT(*) FROM (
+                        SELECT 1 FROM items_corte 
+                        GROUP BY sesion_id, codigo HAVING COUNT(*) > 1
+                    ) d
+                """)
+                duplicados = cursor.fetchone()[0]
+                
+                if duplicados == 0:
+                    cursor.execute("""
+                        ALTER TABLE items_corte 
+                        ADD UNIQUE KEY uk_sesion_codigo (sesion_id, codigo), 
+                        DROP INDEX idx_sesion_codigo
+                    """)
+                    logger.info("Índice único uk_sesion_codigo agregado a items_corte")
+                else:
+                    logger.warning(
+                        "items_corte tiene %s códigos duplicados; se mantiene índice no único", duplicados
+                    )
+            
+            # Líneas por sesión (filtro): (sesion_id, linea) reemplaza a idx_linea
+            cursor.execute("""
+                SELECT DISTINCT INDEX_NAME 
+                FROM information_schema.STATISTICS 
+                WHERE TABLE_SCHEMA = DATABASE() 
+                AND TABLE_NAME = 'items_corte' 
+                AND INDEX_NAME IN ('idx_linea', 'idx_sesion_linea')
+            """)
+            
+            indices = {fila[0] for fila in cursor.fetchall()}
+            if 'idx_sesion_linea' not in indices:
+                alter = "ALTER TABLE items_corte ADD INDEX idx_sesion_linea (sesion_id, linea)"
+                if 'idx_linea' in indices:
+                    alter += ", DROP INDEX idx_linea"
+                cursor.execute(alter)
+                logger.info("Índice idx_sesion_linea agregado a items_corte")
+            
+            # Índice de cobertura para los KPIs de la sincronización (sin leer filas completas)
+            cursor.execute("""
+                SELECT COUNT(*) as existe 
+                FROM information_schema.STATISTICS 
+                WHERE TABLE_SCHEMA = DATABASE() 
+                AND TABLE_NAME = 'items_corte' 
+                AND INDEX_NAME = 'idx_items_sync'
+            """)
+            
+            if cursor.fetchone()[0] == 0:
+                cursor.execute("""
+                    ALTER TABLE items_corte 
+                    ADD INDEX idx_items_sync (sesion_id, stock_sistema, linea, conteo_fisico)
+                """)
+                logger.info("Índice idx_items_sync agregado a items_corte")
+            
+            # idx_sesion_fecha: se agregó y se retiró (cada conteo lo escribía); quitarlo si quedó
+            cursor.execute("""
+                SELECT COUNT(*) as existe 
+                FROM information_schema.STATISTICS 
+                WHERE TABLE_SCHEMA = DATABASE() 
+                AND TABLE_NAME = 'items_corte' 
+                AND INDEX_NAME = 'idx_sesion_fecha'
+            """)
+            
+            if cursor.fetchone()[0] > 0:
+                cursor.execute("ALTER TABLE items_corte DROP INDEX idx_sesion_fecha")
+                logger.info("Índice idx_sesion_fecha eliminado de items_corte")
+            
             # Historial
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS historial_movimientos (
@@ -269,6 +567,48 @@ class DBManager:
             conn.commit()
             logger.info("Tablas OK")
     
+    def vaciar_tablas(self) -> List[str]:
+        """Vacía las tablas de datos intercambiándolas por copias vacías con un RENAME atómico.
+        
+        Devuelve los nombres de las tablas viejas, para borrarlas luego con eliminar_tablas()
+        fuera de la sección crítica.
+        """
+        nuevas = [f"{t}_new" for t in self.TABLAS_DATOS]
+        viejas = [f"_old_{t}" for t in self.TABLAS_DATOS]
+        
+        # Restos de un reset anterior interrumpido
+        self.eliminar_tablas(nuevas + viejas)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for tabla, nueva in zip(self.TABLAS_DATOS, nuevas):
+                cursor.execute(f"CREATE TABLE {nueva} LIKE {tabla}")
+            
+            cursor.execute("RENAME TABLE " + ", ".join(
+                f"{tabla} TO {vieja}, {nueva} TO {tabla}"
+                for tabla, nueva, vieja in zip(self.TABLAS_DATOS, nuevas, viejas)
+            ))
+            
+            for tabla, fk in self._FKS_TABLAS.items():
+                cursor.execute(f"ALTER TABLE {tabla} ADD {fk}")
+            cursor.close()
+        
+        logger.info("Tablas de datos reemplazadas por copias vacías")
+        return viejas
+    
+    def eliminar_tablas(self, tablas: List[str]):
+        """DROP de tablas auxiliares (sin verificar FKs entre ellas)"""
+        with self.get_connection() as conn:
+            self.marcar_sesion_alterada(conn)
+            cursor = conn.cursor()
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            try:
+                cursor.execute("DROP TABLE IF EXISTS " + ", ".join(tablas))
+            finally:
+                # Reactivar siempre: la conexión vuelve al pool sin reset de sesión
+                cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+                cursor.close()
+    
     def execute_query(self, query: str, params: tuple = None, fetch: bool = False):
         try:
             with self.get_connection() as conn:
@@ -285,7 +625,269 @@ class DBManager:
                     cursor.close()
                     return last_id
         except Error as e:
-            logger.error(f"Error query: {e}")
+            logger.error("Error query: %s", e)
+            raise
+    
+    def execute_query_preparada(self, query: str, params: tuple = None) -> List[tuple]:
+        """SELECT recurrente con un cursor preparado que se reutiliza por conexión.
+        
+        El servidor parsea y planifica cada texto SQL una sola vez por conexión del pool;
+        las siguientes ejecuciones solo envían los parámetros. Filas como tuplas, en el
+        orden de columnas del SELECT.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = self._cursor_preparado(conn, query)
+                cursor.execute(query, params or ())
+                return cursor.fetchall()
+        except Error as e:
+            logger.error("Error query preparada: %s", e)
+            raise
+    
+    def _cursor_preparado(self, conn, query: str):
+        """Cursor preparado para query, cacheado en la conexión física del pool"""
+        cnx = getattr(conn, '_cnx', conn)
+        cache = getattr(cnx, '_preparadas', None)
+        # Una reconexión invalida las sentencias preparadas en el servidor
+        if cache is None or cache[0] != conn.connection_id:
+            cache = (conn.connection_id, {})
+            cnx._preparadas = cache
+        
+        cursores = cache[1]
+        cursor = cursores.get(query)
+        if cursor is None:
+            if len(cursores) >= self.MAX_PREPARADAS:
+                for viejo in cursores.values():
+                    viejo.close()
+                cursores.clear()
+            cursor = conn.cursor(prepared=True)
+            cursores[query] = cursor
+        return cursor
+    
+    def execute_query_rows(self, query: str, params: tuple = None) -> Tuple[List[tuple], Tuple[str, ...]]:
+        """SELECT con filas como tuplas (sin un dict por fila) y los nombres de columna"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params or ())
+                rows = cursor.fetchall()
+                cols = tuple(cursor.column_names)
+                cursor.close()
+                return rows, cols
+        except Error as e:
+            logger.error("Error query: %s", e)
+            raise
+    
+    def stream_query(self, query: str, params: tuple = None, batch: int = 2000):
+        """SELECT en streaming: genera (columnas, filas) por lotes sin cargar todo en memoria.
+        
+        Siempre genera al menos un lote (vacío si no hay filas) para exponer las columnas.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor(buffered=False)
+            try:
+                cursor.execute(query, params or ())
+                cols = tuple(cursor.column_names)
+                
+                rows = cursor.fetchmany(batch)
+                yield cols, rows
+                while rows:
+                    rows = cursor.fetchmany(batch)
+                    if rows:
+                        yield cols, rows
+            finally:
+                # Si el consumidor cortó antes del final quedan filas sin leer
+                self.cerrar_streaming(conn, cursor)
+    
+    @staticmethod
+    def cerrar_streaming(conn, cursor):
+        """Cierra un cursor sin buffer descartando las filas que queden sin leer.
+        
+        cursor.close() con resultado pendiente lanza "Unread result found" y la conexión
+        volvería así al pool (sin reset de sesión). Si no se puede vaciar, se desconecta:
+        el pool la reabre limpia en el próximo préstamo.
+        """
+        try:
+            conn.consume_results()
+            cursor.close()
+        except Error as e:
+            logger.warning("No se pudo vaciar el cursor (%s); se descarta la conexión", e)
+            conn.disconnect()
+
+    def get_item(self, sesion_id: int, codigo: str) -> Optional[Dict[str, Any]]:
+        """Obtiene un item del corte (con equipo), siempre leído de la BD"""
+        rows = self.execute_query_preparada(self.SQL_ITEM, (sesion_id, codigo))
+        return dict(zip(self.COLUMNAS_ITEM, rows[0])) if rows else None
+    
+    def guardar_conteo(self, sesion_id: int, codigo: str, cantidad, novedad: str,
+                       equipo_id: int, tipo: str, cantidad_anterior) -> None:
+        """Registra un conteo: UPDATE del item e INSERT en historial en una sola transacción.
+        
+        El historial toma fecha_conteo del propio item, así ambas filas comparten la misma
+        marca de tiempo sin un viaje extra para leer NOW().
+        """
+        try:
+            with self.get_connection() as conn:
+                conn.start_transaction()
+                self._cursor_preparado(conn, self.SQL_CONTEO_ITEM).execute(
+                    self.SQL_CONTEO_ITEM, (cantidad, novedad, equipo_id, sesion_id, codigo)
+                )
+                self._cursor_preparado(conn, self.SQL_CONTEO_HISTORIAL).execute(
+                    self.SQL_CONTEO_HISTORIAL,
+                    (sesion_id, codigo, equipo_id, tipo, cantidad_anterior, cantidad, sesion_id, codigo)
+                )
+                conn.commit()
+        except Error as e:
+            logger.error("Error guardando conteo: %s", e)
+            raise
+    
+    def execute_many(self, query: str, seq_params: List[tuple], chunk_size: int = 1000) -> int:
+        """Ejecuta un INSERT/UPDATE por lotes con una sola conexión y un solo commit"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                total = 0
+                
+                # Lotes acotados para no superar max_allowed_packet
+                for i in range(0, len(seq_params), chunk_size):
+                    cursor.executemany(query, seq_params[i:i + chunk_size])
+                    total += cursor.rowcount
+                
+                conn.commit()
+                cursor.close()
+                return total
+        except Error as e:
+            logger.error("Error query por lotes: %s", e)
+            raise
+    
+    def _filas_por_lote(self, cursor, filas: List[tuple]) -> int:
+        """Filas por INSERT multi-fila según max_allowed_packet y el tamaño medio de fila"""
+        if self._max_packet is None:
+            cursor.execute("SELECT @@max_allowed_packet")
+            self._max_packet = int(cursor.fetchone()[0])
+        
+        muestra = filas[:200]
+        bytes_fila = max(1, sum(len(repr(f)) for f in muestra) // len(muestra))
+        # Usar la mitad del paquete como margen para escapes y overhead del protocolo
+        return max(1, min(self.MAX_FILAS_LOTE, (self._max_packet // 2) // bytes_fila))
+    
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _sql_multifila(prefijo: str, n_cols: int, n_filas: int) -> str:
+        """Texto del INSERT multi-fila; se arma una vez por tamaño de lote"""
+        fila_sql = "(" + ",".join(["%s"] * n_cols) + ")"
+        return f"{prefijo} VALUES " + ",".join([fila_sql] * n_filas)
+    
+    def insert_multifila(self, cursor, prefijo: str, filas: List[tuple]) -> int:
+        """INSERT ... VALUES (...),(...) explícito, en lotes acotados por max_allowed_packet.
+        
+        prefijo: "INSERT INTO tabla (col1, col2, ...)" sin la cláusula VALUES.
+        No hace commit: la transacción la controla quien llama.
+        """
+        if not filas:
+            return 0
+        
+        n_cols = len(filas[0])
+        lote = self._filas_por_lote(cursor, filas)
+        total = 0
+        
+        for i in range(0, len(filas), lote):
+            batch = filas[i:i + lote]
+            sql = self._sql_multifila(prefijo, n_cols, len(batch))
+            cursor.execute(sql, [v for fila in batch for v in fila])
+            total += cursor.rowcount
+        return total
+    
+    def cargar_infile(self, cursor, tabla: str, columnas: Tuple[str, ...], filas: List[tuple]) -> int:
+        """Carga masiva con LOAD DATA LOCAL INFILE desde un CSV temporal.
+        
+        No hace commit. Lanza Error si el servidor no tiene habilitado local_infile.
+        """
+        fd, ruta = tempfile.mkstemp(suffix=".csv", dir=self.CARGA_DIR)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n').writerows(filas)
+            
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {tabla} CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY ',' ENCLOSED BY '\"' ESCAPED BY '' "
+                "LINES TERMINATED BY '\\n' "
+                f"({', '.join(columnas)})",
+                (ruta,)
+            )
+            return cursor.rowcount
+        finally:
+            os.unlink(ruta)
+    
+    def insertar_masivo(self, cursor, tabla: str, columnas: Tuple[str, ...], filas: List[tuple]) -> int:
+        """Inserta muchas filas: LOAD DATA para lotes grandes, INSERT multi-fila si no está disponible"""
+        if len(filas) > self.UMBRAL_LOAD_DATA:
+            try:
+                return self.cargar_infile(cursor, tabla, columnas, filas)
+            except Error as e:
+                logger.warning("LOAD DATA LOCAL no disponible (%s); se usa INSERT multi-fila", e)
+        
+        return self.insert_multifila(cursor, f"INSERT INTO {tabla} ({', '.join(columnas)})", filas)
+    
+    def actualizar_stock_sesion(self, sesion_id: int, stock: Dict[str, Decimal], chunk_size: int = 1000,
+                                lote_update: int = 2000, progreso=None) -> int:
+        """Aplica el stock calculado a todos los items de un corte con UPDATE ... JOIN por lotes.
+        
+        stock: {codigo normalizado: cantidad}. Se sube a una tabla temporal por lotes multi-fila
+        y el cruce por código se hace en el servidor; los items sin código en el Excel quedan en 0.
+        El UPDATE se aplica por rangos de id con COMMIT por lote para acotar undo log y bloqueos,
+        y solo toca las filas cuyo stock cambia. Devuelve la cantidad de items modificados.
+        progreso(hechos, total) se invoca tras cada lote, desde el hilo que llama.
+        """
+        try:
+            with self.get_connection() as conn:
+                # La tabla temporal vive en la sesión: restablecerla al devolver la conexión
+                self.marcar_sesion_alterada(conn)
+                cursor = conn.cursor()
+                cursor.execute("DROP TEMPORARY TABLE IF EXISTS _stock_new")
+                cursor.execute("""
+                    CREATE TEMPORARY TABLE _stock_new (
+                        codigo VARCHAR(50) PRIMARY KEY,
+                        stock DECIMAL(10,2) NOT NULL
+                    ) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                
+                try:
+                    # Mismo ancho que items_corte.codigo: un código más largo no puede cruzar con ningún item
+                    pares = [(codigo, cant) for codigo, cant in stock.items() if len(codigo) <= 50]
+                    for i in range(0, len(pares), chunk_size):
+                        cursor.executemany(
+                            "INSERT INTO _stock_new (codigo, stock) VALUES (%s, %s)",
+                            pares[i:i + chunk_size]
+                        )
+                    
+                    cursor.execute("SELECT id FROM items_corte WHERE sesion_id=%s ORDER BY id", (sesion_id,))
+                    ids = [fila[0] for fila in cursor.fetchall()]
+                    conn.commit()
+                    
+                    total = 0
+                    for i in range(0, len(ids), lote_update):
+                        rango = ids[i:i + lote_update]
+                        # Cada lote en su propia transacción (rollback en get_connection)
+                        conn.start_transaction()
+                        cursor.execute("""
+                            UPDATE items_corte i
+                            LEFT JOIN _stock_new s ON s.codigo = i.codigo
+                            SET i.stock_sistema = COALESCE(s.stock, 0)
+                            WHERE i.sesion_id = %s AND i.id BETWEEN %s AND %s
+                            AND i.stock_sistema <> COALESCE(s.stock, 0)
+                        """, (sesion_id, rango[0], rango[-1]))
+                        total += cursor.rowcount
+                        conn.commit()
+                        
+                        if progreso:
+                            progreso(i + len(rango), len(ids))
+                finally:
+                    cursor.execute("DROP TEMPORARY TABLE IF EXISTS _stock_new")
+                    cursor.close()
+                return total
+        except Error as e:
+            logger.error("Error actualizando stock del corte: %s", e)
             raise
 
 
@@ -294,82 +896,145 @@ class DBManager:
 # ============================================================================
 class BackupManager:
     BACKUP_DIR = Path("BACKUPS_INVENTARIO")
+    BATCH_FILAS = 500
+    
+    # Escapes de literales de texto compatibles con mysqldump
+    _ESCAPES_SQL = str.maketrans({
+        "\\": "\\\\", "'": "\\'", "\n": "\\n", "\r": "\\r", "\x00": "\\0", "\x1a": "\\Z"
+    })
     
     def __init__(self, db: 'DBManager'):
         self.db = db
         self.BACKUP_DIR.mkdir(exist_ok=True)
     
+    @classmethod
+    def _sql_literal(cls, valor) -> str:
+        """Convierte un valor Python en literal SQL"""
+        if valor is None:
+            return "NULL"
+        if isinstance(valor, bool):
+            return "1" if valor else "0"
+        if isinstance(valor, (int, float, Decimal)):
+            return str(valor)
+        if isinstance(valor, (bytes, bytearray)):
+            return f"X'{valor.hex()}'" if valor else "''"
+        if isinstance(valor, (datetime, date, timedelta)):
+            return f"'{valor}'"
+        return "'" + str(valor).translate(cls._ESCAPES_SQL) + "'"
+    
+    @staticmethod
+    def _leer_sentencias(archivo):
+        """Separa un volcado SQL en sentencias terminadas en ';' al final de línea"""
+        buffer = []
+        for linea in archivo:
+            if not buffer and (not linea.strip() or linea.startswith('--')):
+                continue
+            buffer.append(linea)
+            if linea.rstrip().endswith(';'):
+                yield ''.join(buffer).rstrip().rstrip(';')
+                buffer = []
+        
+        if buffer and ''.join(buffer).strip():
+            yield ''.join(buffer)
+    
     def crear_backup(self) -> Tuple[bool, str]:
-        """Crea backup completo de la BD"""
+        """Crea backup completo de la BD (volcado SQL en proceso, sin mysqldump)"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_file = self.BACKUP_DIR / f"backup_{timestamp}.sql"
+        
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_file = self.BACKUP_DIR / f"backup_{timestamp}.sql"
-            
-            db_config = self.db.db_config
-            
-            # Construir comando mysqldump
-            cmd = (
-                f'mysqldump -h {db_config["host"]} '
-                f'-P {db_config.get("port", 3306)} '
-                f'-u {db_config["user"]} '
-            )
-            
-            if db_config['password']:
-                cmd += f'-p"{db_config["password"]}" '
-            
-            cmd += f'{db_config["database"]} > "{backup_file}"'
+            db_name = self.db.db_config['database']
             
-            # Ejecutar comando
-            import subprocess
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            with self.db.get_connection() as conn, \
+                    open(backup_file, 'w', encoding='utf-8', newline='\n') as f:
+                cursor = conn.cursor()
+                cursor.execute("SHOW FULL TABLES WHERE Table_type = 'BASE TABLE'")
+                # Omitir tablas viejas de un reset cuyo borrado sigue en curso
+                tablas = [row[0] for row in cursor.fetchall() if not row[0].startswith('_old_')]
+                
+                f.write(f"-- Backup {db_name} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+                f.write("SET NAMES utf8mb4;\n")
+                f.write("SET FOREIGN_KEY_CHECKS=0;\n\n")
+                
+                for tabla in tablas:
+                    cursor.execute(f"SHOW CREATE TABLE `{tabla}`")
+                    create_sql = cursor.fetchone()[1]
+                    f.write(f"DROP TABLE IF EXISTS `{tabla}`;\n{create_sql};\n")
+                    
+                    # Las columnas generadas (ej. diferencia) no admiten INSERT
+                    cursor.execute(
+                        """SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                           AND EXTRA NOT LIKE %s
+                           ORDER BY ORDINAL_POSITION""",
+                        (tabla, '%GENERATED%')
+                    )
+                    columnas = ", ".join(f"`{row[0]}`" for row in cursor.fetchall())
+                    
+                    # Leer filas por lotes sin cargar la tabla completa en memoria
+                    stream = conn.cursor(buffered=False)
+                    try:
+                        stream.execute(f"SELECT {columnas} FROM `{tabla}`")
+                        while True:
+                            filas = stream.fetchmany(self.BATCH_FILAS)
+                            if not filas:
+                                break
+                            valores = ",".join(
+                                "(" + ",".join(self._sql_literal(v) for v in fila) + ")"
+                                for fila in filas
+                            )
+                            f.write(f"INSERT INTO `{tabla}` ({columnas}) VALUES {valores};\n")
+                    finally:
+                        # Un error de escritura deja filas sin leer en el cursor
+                        self.db.cerrar_streaming(conn, stream)
+                    f.write("\n")
+                
+                f.write("SET FOREIGN_KEY_CHECKS=1;\n")
+                cursor.close()
             
-            if result.returncode == 0 and backup_file.exists():
-                size = backup_file.stat().st_size / 1024  # KB
-                logger.info(f"Backup creado: {backup_file.name} ({size:.2f} KB)")
-                return True, str(backup_file)
-            else:
-                error_msg = result.stderr if result.stderr else "Error desconocido"
-                logger.error(f"Error backup: {error_msg}")
-                return False, f"Error: {error_msg}"
+            size = backup_file.stat().st_size / 1024  # KB
+            logger.info("Backup creado: %s (%.2f KB)", backup_file.name, size)
+            return True, str(backup_file)
         
         except Exception as e:
-            logger.error(f"Error creando backup: {e}")
+            logger.error("Error creando backup: %s", e)
+            # No dejar archivos incompletos en la lista de backups
+            if backup_file.exists():
+                backup_file.unlink()
             return False, str(e)
     
     def restaurar_backup(self, backup_path: str) -> Tuple[bool, str]:
-        """Restaura BD desde backup"""
+        """Restaura BD desde backup (compatible con volcados de mysqldump)"""
         try:
             if not Path(backup_path).exists():
                 return False, "Archivo no existe"
             
-            db_config = self.db.db_config
-            
-            # Construir comando mysql
-            cmd = (
-                f'mysql -h {db_config["host"]} '
-                f'-P {db_config.get("port", 3306)} '
-                f'-u {db_config["user"]} '
-            )
-            
-            if db_config['password']:
-                cmd += f'-p"{db_config["password"]}" '
-            
-            cmd += f'{db_config["database"]} < "{backup_path}"'
-            
-            # Ejecutar comando
-            import subprocess
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            ejecutadas = 0
+            with self.db.get_connection() as conn, \
+                    open(backup_path, 'r', encoding='utf-8') as f:
+                # El volcado fija variables de sesión (SET ...): restablecerla al devolver la conexión
+                self.db.marcar_sesion_alterada(conn)
+                cursor = conn.cursor()
+                try:
+                    for sentencia in self._leer_sentencias(f):
+                        cursor.execute(sentencia)
+                        if cursor.with_rows:
+                            cursor.fetchall()
+                        ejecutadas += 1
+                    
+                    conn.commit()
+                finally:
+                    # El volcado apaga FOREIGN_KEY_CHECKS (y mysqldump también UNIQUE_CHECKS);
+                    # si falla a mitad, la conexión volvería así al pool sin reset de sesión
+                    cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+                    cursor.execute("SET UNIQUE_CHECKS = 1")
+                    cursor.close()
             
-            if result.returncode == 0:
-                logger.info(f"Backup restaurado: {backup_path}")
-                return True, "Backup restaurado exitosamente"
-            else:
-                error_msg = result.stderr if result.stderr else "Error desconocido"
-                logger.error(f"Error restaurando: {error_msg}")
-                return False, f"Error: {error_msg}"
+            logger.info("Backup restaurado: %s (%s sentencias)", backup_path, ejecutadas)
+            return True, "Backup restaurado exitosamente"
         
         except Exception as e:
-            logger.error(f"Error restaurando backup: {e}")
+            logger.error("Error restaurando backup: %s", e)
             return False, str(e)
     
     def listar_backups(self) -> List[Dict[str, Any]]:
@@ -385,7 +1050,7 @@ class BackupManager:
                     'tamaño_kb': stat.st_size / 1024
                 })
         except Exception as e:
-            logger.error(f"Error listando backups: {e}")
+            logger.error("Error listando backups: %s", e)
         
         return backups
     
@@ -393,10 +1058,10 @@ class BackupManager:
         """Elimina un backup"""
         try:
             Path(backup_path).unlink()
-            logger.info(f"Backup eliminado: {backup_path}")
+            logger.info("Backup eliminado: %s", backup_path)
             return True
         except Exception as e:
-            logger.error(f"Error eliminando backup: {e}")
+            logger.error("Error eliminando backup: %s", e)
             return False
 
 
@@ -439,46 +1104,235 @@ class InputValidator:
 # UTILIDADES
 # ============================================================================
 class Utils:
+    HOJAS_STOCK = ("CONDI", "MAQUI", "ASCINTEC")
+    BUFFER_EXCEL = 1 << 20
+    
     @staticmethod
     def limpiar_codigo(valor):
         """Limpia y normaliza códigos"""
+        # Un valor suelto no pasa por pandas: el escaneo llama aquí en cada lectura
+        if not hasattr(valor, 'str'):
+            return str(valor).strip().upper()
+        import pandas as pd
         if isinstance(valor, pd.Series):
             return valor.astype(str).str.strip().str.upper()
         return str(valor).strip().upper()
     
     @staticmethod
-    def calcular_stock_desde_excel(excel_path: str) -> Dict[str, float]:
-        """Calcula stock sumando múltiples hojas"""
-        stock = {}
-        hojas = ["CONDI", "MAQUI", "ASCINTEC"]
+    @lru_cache(maxsize=None)
+    def motor_lectura_excel() -> Optional[str]:
+        """Motor de lectura Excel: python-calamine (Rust) si está disponible, si no el de pandas"""
+        try:
+            import python_calamine  # noqa: F401
+        except ImportError:
+            return None
+        import pandas as pd
+        version = tuple(int(x) for x in pd.__version__.split('.')[:2])
+        return 'calamine' if version >= (2, 2) else None
+    
+    @staticmethod
+    def abrir_excel(excel_path: Union[str, pd.ExcelFile]) -> pd.ExcelFile:
+        """Devuelve el libro abierto una sola vez para leer varias hojas"""
+        import pandas as pd
+        if isinstance(excel_path, pd.ExcelFile):
+            return excel_path
+        # El .xlsx es un ZIP: un búfer de 1 MiB evita miles de lecturas de 8 KiB
+        fh = open(excel_path, "rb", buffering=Utils.BUFFER_EXCEL)
+        try:
+            libro = pd.ExcelFile(fh, engine=Utils.motor_lectura_excel())
+        except Exception:
+            fh.close()
+            raise
+        
+        # ExcelFile no cierra los archivos que recibe abiertos
+        cerrar_libro = libro.close
         
-        for hoja in hojas:
+        def cerrar():
+            try:
+                cerrar_libro()
+            finally:
+                fh.close()
+        
+        libro.close = cerrar
+        return libro
+    
+    @staticmethod
+    def _stock_calamine(excel_path: str) -> Optional[Dict[str, float]]:
+        """Suma el stock directamente sobre las celdas tipadas de python-calamine, sin DataFrames.
+        
+        Devuelve None si python-calamine no está instalado.
+        """
+        try:
+            from python_calamine import CalamineWorkbook
+        except ImportError:
+            return None
+        
+        wb = CalamineWorkbook.from_path(excel_path)
+        stock: Dict[str, float] = {}
+        
+        for hoja in Utils.HOJAS_STOCK:
+            try:
+                filas = wb.get_sheet_by_name(hoja).to_python(skip_empty_area=True)
+            except Exception as e:
+                logger.warning("Hoja '%s': %s", hoja, e)
+                continue
+            
+            if not filas:
+                continue
+            
+            cabecera = [str(c).strip().lower() for c in filas[0]]
+            if 'codproducto' not in cabecera or 'sin_stock' not in cabecera:
+                continue
+            i_cod = cabecera.index('codproducto')
+            i_stock = cabecera.index('sin_stock')
+            
+            for fila in filas[1:]:
+                cod = fila[i_cod]
+                valor = fila[i_stock]
+                if cod is None or cod == '':
+                    continue
+                
+                # Mismo criterio que pandas: 123.0 -> "123"
+                if isinstance(cod, float) and cod.is_integer():
+                    cod = int(cod)
+                
+                if isinstance(valor, str):
+                    try:
+                        valor = float(valor.replace(",", "."))
+                    except ValueError:
+                        continue
+                elif isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                    continue
+                if valor != valor:  # NaN
+                    continue
+                
+                codigo = str(cod).strip().upper()
+                stock[codigo] = stock.get(codigo, 0.0) + float(valor)
+        
+        return stock
+    
+    @staticmethod
+    def calcular_stock_desde_excel(excel_path: Union[str, pd.ExcelFile]) -> Dict[str, float]:
+        """Calcula stock sumando múltiples hojas"""
+        # Ruta rápida: lectura directa con python-calamine
+        if isinstance(excel_path, str):
+            stock = Utils._stock_calamine(excel_path)
+            if stock is not None:
+                logger.info("Stock calculado: %s items", len(stock))
+                return stock
+        
+        import pandas as pd
+        partes = []
+        libro = Utils.abrir_excel(excel_path)
+        
+        for hoja in Utils.HOJAS_STOCK:
             try:
-                df = pd.read_excel(excel_path, sheet_name=hoja, dtype=str)
+                # Leer solo las dos columnas necesarias
+                df = libro.parse(
+                    hoja, dtype=str,
+                    usecols=lambda c: str(c).strip().lower() in ('codproducto', 'sin_stock')
+                )
                 df.columns = df.columns.str.strip().str.lower()
                 
                 if 'codproducto' in df.columns and 'sin_stock' in df.columns:
-                    for _, row in df.iterrows():
-                        codigo = Utils.limpiar_codigo(row['codproducto'])
-                        valor = pd.to_numeric(
-                            str(row['sin_stock']).replace(",", "."),
-                            errors='coerce'
-                        )
-                        if pd.notnull(valor):
-                            # Convertir float64 a float de Python
-                            stock[codigo] = float(stock.get(codigo, 0.0) + valor)
+                    partes.append(df[['codproducto', 'sin_stock']])
             except Exception as e:
-                logger.warning(f"Hoja '{hoja}': {e}")
+                logger.warning("Hoja '%s': %s", hoja, e)
+        
+        # Cerrar solo si el libro se abrió aquí
+        if libro is not excel_path:
+            libro.close()
+        
+        stock = {}
+        if partes:
+            # Una sola pasada vectorizada y un único groupby sobre todas las hojas
+            df = pd.concat(partes, ignore_index=True)
+            valores = pd.to_numeric(
+                df['sin_stock'].str.replace(",", ".", regex=False),
+                errors='coerce'
+            )
+            serie = pd.Series(valores.values, index=Utils.limpiar_codigo(df['codproducto']).values).dropna()
+            # Convertir float64 a float de Python
+            stock = serie.groupby(level=0, sort=False).sum().astype(float).to_dict()
         
-        logger.info(f"Stock calculado: {len(stock)} items")
+        logger.info("Stock calculado: %s items", len(stock))
         return stock
     
     @staticmethod
-    def cargar_equipos_desde_excel(excel_path: str) -> List[dict]:
+    def hora_actual() -> str:
+        """Hora local HH:MM:SS sin construir datetime ni pasar por strftime/locale"""
+        t = time.localtime()
+        return f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"
+    
+    @staticmethod
+    def prefetch(iterable, adelanto: int = 2):
+        """Recorre iterable en un hilo aparte, hasta `adelanto` elementos por delante del consumidor.
+        
+        Solapa la E/S del productor (p. ej. fetchmany) con el trabajo del consumidor. Los errores
+        del productor se relanzan en el consumidor; si este se detiene, el productor se cierra.
+        """
+        cola = queue.Queue(maxsize=adelanto)
+        fin = object()
+        parar = threading.Event()
+        
+        def poner(elem):
+            # put con espera acotada para no quedar bloqueado si el consumidor ya no lee
+            while not parar.is_set():
+                try:
+                    cola.put(elem, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def producir():
+            it = iter(iterable)
+            try:
+                for elem in it:
+                    if not poner((elem, None)):
+                        return
+                poner((fin, None))
+            except Exception as e:
+                poner((fin, e))
+            finally:
+                # Un generador (p. ej. stream_query) libera aquí su cursor y conexión
+                cerrar = getattr(it, 'close', None)
+                if cerrar:
+                    cerrar()
+        
+        threading.Thread(target=producir, daemon=True).start()
+        try:
+            while True:
+                elem, error = cola.get()
+                if elem is fin:
+                    if error:
+                        raise error
+                    return
+                yield elem
+        finally:
+            parar.set()
+    
+    @staticmethod
+    def stock_a_decimal(stock: Dict[str, float]) -> Dict[str, Decimal]:
+        """Convierte el stock una sola vez a Decimal con la escala de stock_sistema (DECIMAL(10,2))"""
+        escala = Decimal("0.01")
+        return {
+            codigo: Decimal(repr(valor)).quantize(escala, rounding=ROUND_HALF_UP)
+            for codigo, valor in stock.items()
+        }
+    
+    @staticmethod
+    def cargar_equipos_desde_excel(excel_path: Union[str, pd.ExcelFile]) -> List[dict]:
         """Carga equipos desde la hoja EQUIPOS del Excel (ID, INTEGRANTES, FECHA DEL EQUIPO)"""
+        import pandas as pd
         equipos = []
         try:
-            df = pd.read_excel(excel_path, sheet_name="EQUIPOS", dtype=str)
+            libro = Utils.abrir_excel(excel_path)
+            try:
+                df = libro.parse("EQUIPOS", dtype=str)
+            finally:
+                if libro is not excel_path:
+                    libro.close()
             
             # Buscar columnas (ID, INTEGRANTES, FECHA DEL EQUIPO)
             col_id = None
@@ -492,26 +1346,96 @@ class Utils:
                     col_integrantes = col
             
             if col_id:
-                for idx, row in df.iterrows():
-                    num_equipo = str(row[col_id]).strip() if pd.notna(row[col_id]) else None
+                columnas = [col_id, col_integrantes] if col_integrantes else [col_id]
+                sub = df[columnas].dropna(subset=[col_id])
+                
+                # Tuplas simples en lugar de una Series por fila
+                for row in sub.itertuples(index=False, name=None):
+                    num_equipo = str(row[0]).strip()
                     if num_equipo and num_equipo != 'nan':
-                        equipo_data = {'numero': num_equipo}
-                        if col_integrantes and pd.notna(row[col_integrantes]):
-                            equipo_data['integrantes'] = str(row[col_integrantes]).strip().upper()
-                        else:
-                            equipo_data['integrantes'] = ''
-                        equipos.append(equipo_data)
+                        integrantes = row[1] if col_integrantes else None
+                        equipos.append({
+                            'numero': num_equipo,
+                            'integrantes': str(integrantes).strip().upper() if pd.notna(integrantes) else ''
+                        })
                 
-                logger.info(f"Equipos cargados desde Excel: {len(equipos)}")
+                logger.info("Equipos cargados desde Excel: %s", len(equipos))
             else:
                 logger.warning("No se encontró columna ID en hoja EQUIPOS")
         
         except Exception as e:
-            logger.warning(f"No se pudo cargar hoja EQUIPOS: {e}")
+            logger.warning("No se pudo cargar hoja EQUIPOS: %s", e)
         
         return equipos
 
 
+# ============================================================================
+# SONIDOS
+# ============================================================================
+class Sonidos:
+    """Pitidos pregenerados como WAV y reproducidos sin bloquear la UI"""
+    DIR = Path(tempfile.gettempdir()) / "inventario_sonidos"
+    SAMPLE_RATE = 22050
+    # nombre: (frecuencia Hz, duración ms)
+    TONOS = {
+        'ok': (1000, 200),
+        'aviso': (700, 400),
+        'error': (500, 300)
+    }
+    _archivos: Dict[str, str] = {}
+    
+    @classmethod
+    def _generar_wav(cls, path: Path, freq: int, ms: int):
+        """Escribe un tono senoidal mono de 16 bits"""
+        n = cls.SAMPLE_RATE * ms // 1000
+        paso = 2 * math.pi * freq / cls.SAMPLE_RATE
+        muestras = array('h', (int(16000 * math.sin(paso * i)) for i in range(n)))
+        if sys.byteorder == 'big':
+            muestras.byteswap()
+        
+        with wave.open(str(path), 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(cls.SAMPLE_RATE)
+            w.writeframes(muestras.tobytes())
+    
+    @classmethod
+    def _archivo(cls, nombre: str) -> str:
+        """Genera el WAV la primera vez y lo reutiliza después"""
+        if nombre not in cls._archivos:
+            freq, ms = cls.TONOS[nombre]
+            cls.DIR.mkdir(exist_ok=True)
+            path = cls.DIR / f"{nombre}_{freq}_{ms}.wav"
+            if not path.exists():
+                cls._generar_wav(path, freq, ms)
+            cls._archivos[nombre] = str(path)
+        return cls._archivos[nombre]
+    
+    @classmethod
+    def precargar(cls):
+        """Genera todos los WAV por adelantado (pensado para un hilo en segundo plano)"""
+        if winsound is None:
+            return
+        for nombre in cls.TONOS:
+            try:
+                cls._archivo(nombre)
+            except Exception as e:
+                logger.warning("No se pudo generar sonido '%s': %s", nombre, e)
+    
+    @classmethod
+    def play(cls, nombre: str):
+        """Reproduce un tono de forma asíncrona (SND_MEMORY no admite SND_ASYNC)"""
+        if winsound is None:
+            return
+        try:
+            winsound.PlaySound(
+                cls._archivo(nombre),
+                winsound.SND_FILENAME | winsound.SND_ASYNC | winsound.SND_NOWAIT
+            )
+        except Exception:
+            pass
+
+
 # ============================================================================
 # VENTANA MULTISELECT
 # ============================================================================
@@ -550,10 +1474,13 @@ class VentanaMultiSelect(ctk.CTkToplevel):
         for op in sorted(opciones):
             var = ctk.BooleanVar(value=True)
             cb = ctk.CTkCheckBox(self.scroll, text=op, variable=var,
-                                 command=self._update_count)
+                                 command=lambda v=var: self._on_toggle(v))
             cb.pack(anchor="w", pady=3, padx=5)
             self.vars.append((op, var))
         
+        # Contador incremental: evita recorrer todas las variables en cada click
+        self._sel_count = len(self.vars)
+        
         ctk.CTkButton(self, text="APLICAR FILTRO", fg_color=Colors.SUCCESS,
                       height=40, font=("Arial", 14, "bold"),
                       command=self._apply).pack(fill="x", padx=20, pady=15)
@@ -563,16 +1490,21 @@ class VentanaMultiSelect(ctk.CTkToplevel):
     def _select_all(self):
         for _, var in self.vars:
             var.set(True)
+        self._sel_count = len(self.vars)
         self._update_count()
     
     def _select_none(self):
         for _, var in self.vars:
             var.set(False)
+        self._sel_count = 0
+        self._update_count()
+    
+    def _on_toggle(self, var):
+        self._sel_count += 1 if var.get() else -1
         self._update_count()
     
     def _update_count(self):
-        sel = sum(1 for _, v in self.vars if v.get())
-        self.lbl_count.configure(text=f"{sel}/{len(self.vars)} seleccionadas")
+        self.lbl_count.configure(text=f"{self._sel_count}/{len(self.vars)} seleccionadas")
     
     def _apply(self):
         selected = [op for op, var in self.vars if var.get()]
@@ -580,7 +1512,7 @@ class VentanaMultiSelect(ctk.CTkToplevel):
         try:
             self.callback(selected)
         except Exception as e:
-            logger.error(f"Error callback filtro: {e}")
+            logger.error("Error callback filtro: %s", e)
         finally:
             self.after(100, self.destroy)
 
@@ -628,11 +1560,16 @@ class VentanaBackups(ctk.CTkToplevel):
         self.scroll = ctk.CTkScrollableFrame(self, fg_color="transparent")
         self.scroll.pack(fill="both", expand=True, padx=10, pady=5)
         
+        # Filas reutilizables (se reconfiguran en lugar de destruirse)
+        self._filas = []
+        self.lbl_vacio = ctk.CTkLabel(self.scroll, text="No hay backups disponibles", 
+                                      text_color="gray", font=("Arial", 12))
+        
         self._load_backups()
     
     def _crear_backup(self):
         self.lbl_info.configure(text="Creando backup...", text_color=Colors.WARNING)
-        self.update()
+        self.update_idletasks()
         
         success, msg = self.backup_mgr.crear_backup()
         
@@ -644,48 +1581,71 @@ class VentanaBackups(ctk.CTkToplevel):
             messagebox.showerror("Error", f"Error al crear backup:\n{msg}")
             self.lbl_info.configure(text="Error al crear backup", text_color=Colors.DANGER)
     
-    def _load_backups(self):
-        for w in self.scroll.winfo_children():
-            w.destroy()
+    def _crear_fila_backup(self) -> Dict[str, Any]:
+        """Crea los widgets de una fila de backup (se reutilizan entre recargas)"""
+        frame = ctk.CTkFrame(self.scroll, fg_color=Colors.CARD)
+        
+        # Info frame
+        info_f = ctk.CTkFrame(frame, fg_color="transparent")
+        info_f.pack(side="left", fill="both", expand=True, padx=15, pady=10)
+        
+        lbl_nombre = ctk.CTkLabel(info_f, text="", 
+                                  font=("Arial", 12, "bold"), anchor="w")
+        lbl_nombre.pack(anchor="w")
+        
+        lbl_meta = ctk.CTkLabel(info_f, text="", 
+                                font=("Arial", 10), text_color="gray", anchor="w")
+        lbl_meta.pack(anchor="w")
+        
+        # Botones
+        btn_f = ctk.CTkFrame(frame, fg_color="transparent")
+        btn_f.pack(side="right", padx=10)
+        
+        btn_restaurar = ctk.CTkButton(btn_f, text="RESTAURAR", width=100, height=30,
+                                      fg_color=Colors.WARNING)
+        btn_restaurar.pack(pady=2)
+        
+        btn_eliminar = ctk.CTkButton(btn_f, text="ELIMINAR", width=100, height=30,
+                                     fg_color=Colors.DANGER)
+        btn_eliminar.pack(pady=2)
         
+        return {
+            'frame': frame, 'lbl_nombre': lbl_nombre, 'lbl_meta': lbl_meta,
+            'btn_restaurar': btn_restaurar, 'btn_eliminar': btn_eliminar
+        }
+    
+    def _load_backups(self):
         backups = self.backup_mgr.listar_backups()
         
+        # Ocultar filas sobrantes en lugar de destruirlas
+        for fila in self._filas[len(backups):]:
+            fila['frame'].pack_forget()
+        
         if not backups:
-            ctk.CTkLabel(self.scroll, text="No hay backups disponibles", 
-                       text_color="gray", font=("Arial", 12)).pack(pady=30)
+            self.lbl_vacio.pack(pady=30)
             self.lbl_info.configure(text="0 backups encontrados")
             return
         
+        self.lbl_vacio.pack_forget()
         self.lbl_info.configure(text=f"{len(backups)} backup(s) disponible(s)")
         
-        for bk in backups:
-            frame = ctk.CTkFrame(self.scroll, fg_color=Colors.CARD)
-            frame.pack(fill="x", pady=3, padx=5)
-            
-            # Info frame
-            info_f = ctk.CTkFrame(frame, fg_color="transparent")
-            info_f.pack(side="left", fill="both", expand=True, padx=15, pady=10)
-            
-            ctk.CTkLabel(info_f, text=bk['nombre'], 
-                       font=("Arial", 12, "bold"), anchor="w").pack(anchor="w")
+        for i, bk in enumerate(backups):
+            if i < len(self._filas):
+                fila = self._filas[i]
+            else:
+                fila = self._crear_fila_backup()
+                self._filas.append(fila)
             
             fecha_str = bk['fecha'].strftime('%d/%m/%Y %H:%M:%S')
-            ctk.CTkLabel(info_f, text=f"{fecha_str} | {bk['tamaño_kb']:.2f} KB", 
-                       font=("Arial", 10), text_color="gray", anchor="w").pack(anchor="w")
-            
-            # Botones
-            btn_f = ctk.CTkFrame(frame, fg_color="transparent")
-            btn_f.pack(side="right", padx=10)
+            fila['lbl_nombre'].configure(text=bk['nombre'])
+            fila['lbl_meta'].configure(text=f"{fecha_str} | {bk['tamaño_kb']:.2f} KB")
+            fila['btn_restaurar'].configure(
+                command=lambda p=bk['path'], n=bk['nombre']: self._restaurar_backup(p, n))
+            fila['btn_eliminar'].configure(
+                command=lambda p=bk['path'], n=bk['nombre']: self._eliminar_backup(p, n))
             
-            ctk.CTkButton(btn_f, text="RESTAURAR", width=100, height=30,
-                         fg_color=Colors.WARNING,
-                         command=lambda p=bk['path'], n=bk['nombre']: 
-                         self._restaurar_backup(p, n)).pack(pady=2)
-            
-            ctk.CTkButton(btn_f, text="ELIMINAR", width=100, height=30,
-                         fg_color=Colors.DANGER,
-                         command=lambda p=bk['path'], n=bk['nombre']: 
-                         self._eliminar_backup(p, n)).pack(pady=2)
+            if not fila['frame'].winfo_manager():
+                fila['frame'].pack(fill="x", pady=3, padx=5)
     
     def _restaurar_backup(self, path: str, nombre: str):
         msg = (
@@ -700,7 +1660,7 @@ class VentanaBackups(ctk.CTkToplevel):
             return
         
         self.lbl_info.configure(text="Restaurando backup...", text_color=Colors.WARNING)
-        self.update()
+        self.update_idletasks()
         
         success, msg = self.backup_mgr.restaurar_backup(path)
         
@@ -743,7 +1703,7 @@ class VentanaResetBD(ctk.CTkToplevel):
         header.pack(fill="x")
         
         ctk.CTkLabel(header, text="RESETEAR BASE DE DATOS", 
-                    font=("Arial", 20, "bold"), text_color="white").pack(pady=15)
+                    font=Fonts.BOLD_20, text_color="white").pack(pady=15)
         
         # Info
         info = ctk.CTkFrame(self, fg_color=Colors.CARD)
@@ -761,7 +1721,7 @@ class VentanaResetBD(ctk.CTkToplevel):
         )
         
         ctk.CTkLabel(info, text=warning_text, 
-                    font=("Arial", 13), justify="left",
+                    font=Fonts.NORMAL_13, justify="left",
                     text_color=Colors.DANGER).pack(pady=20, padx=20)
         
         # Checkbox de confirmación
@@ -770,7 +1730,7 @@ class VentanaResetBD(ctk.CTkToplevel):
             info, 
             text="Entiendo los riesgos y deseo continuar",
             variable=self.var_confirmar,
-            font=("Arial", 12, "bold"),
+            font=Fonts.BOLD_12,
             command=self._toggle_buttons
         )
         self.cb_confirmar.pack(pady=15)
@@ -784,7 +1744,7 @@ class VentanaResetBD(ctk.CTkToplevel):
             text="CREAR BACKUP PRIMERO",
             fg_color=Colors.SUCCESS, 
             height=45,
-            font=("Arial", 13, "bold"),
+            font=Fonts.BOLD_13,
             command=self._crear_backup_y_reset
         )
         self.btn_backup.pack(fill="x", pady=5)
@@ -794,7 +1754,7 @@ class VentanaResetBD(ctk.CTkToplevel):
             text="RESETEAR SIN BACKUP",
             fg_color=Colors.DANGER, 
             height=45,
-            font=("Arial", 13, "bold"),
+            font=Fonts.BOLD_13,
             state="disabled",
             command=self._reset_bd
         )
@@ -835,41 +1795,44 @@ class VentanaResetBD(ctk.CTkToplevel):
         ):
             return
         
-        try:
-            # Eliminar todas las tablas y recrearlas
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Desactivar foreign key checks
-                cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
-                
-                # Eliminar tablas
-                tablas = ['historial_movimientos', 'items_corte', 'equipos', 'sesiones']
-                for tabla in tablas:
-                    cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
-                    logger.info(f"Tabla {tabla} eliminada")
-                
-                # Reactivar foreign key checks
-                cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
-                
-                conn.commit()
-            
-            # Recrear tablas
-            self.db._create_tables()
-            
-            messagebox.showinfo(
-                "Exito",
-                "Base de datos reseteada exitosamente.\n\nLa aplicacion se reiniciara."
-            )
-            
-            logger.info("Base de datos reseteada exitosamente")
+        self.btn_backup.configure(state="disabled")
+        self.btn_reset.configure(state="disabled")
+        
+        def reset_background():
+            try:
+                # Intercambio atómico por tablas vacías: instantáneo sin importar el tamaño
+                viejas = self.db.vaciar_tablas()
+            except Exception as e:
+                logger.error("Error reseteando BD: %s", e)
+                self.after(0, lambda err=e: self._on_reset_error(err))
+                return
             
-            self.callback()
-            self.destroy()
+            self.after(0, self._on_reset_completo)
             
-        except Exception as e:
-            logger.error(f"Error reseteando BD: {e}")
-            messagebox.showerror("Error", f"Error al resetear BD:\n{e}")
+            # El borrado físico de los datos viejos queda fuera de la sección crítica
+            try:
+                self.db.eliminar_tablas(viejas)
+                logger.info("Tablas anteriores eliminadas")
+            except Exception as e:
+                logger.warning("No se pudieron eliminar tablas anteriores: %s", e)
+        
+        threading.Thread(target=reset_background, daemon=True).start()
+    
+    def _on_reset_completo(self):
+        messagebox.showinfo(
+            "Exito",
+            "Base de datos reseteada exitosamente.\n\nLa aplicacion se reiniciara."
+        )
+        
+        logger.info("Base de datos reseteada exitosamente")
+        
+        self.callback()
+        self.destroy()
+    
+    def _on_reset_error(self, error: Exception):
+        self.btn_backup.configure(state="normal")
+        self._toggle_buttons()
+        messagebox.showerror("Error", f"Error al resetear BD:\n{error}")
 
 
 # ============================================================================
@@ -892,24 +1855,31 @@ class VentanaActualizarStock(ctk.CTkToplevel):
         header = ctk.CTkFrame(self, fg_color="#6A1B9A")
         header.pack(fill="x")
         ctk.CTkLabel(header, text="ACTUALIZAR STOCK",
-                    font=("Arial", 18, "bold"), text_color="white").pack(pady=15)
+                    font=Fonts.BOLD_18, text_color="white").pack(pady=15)
         
         # Info del corte
         info = ctk.CTkFrame(self, fg_color=Colors.CARD)
         info.pack(fill="x", padx=20, pady=10)
         
+        # Datos del corte y cantidad de items en un solo viaje a la BD
+        self._n_items = 0
         try:
-            sesion_info = self.db.execute_query(
-                "SELECT nombre, fecha, responsable FROM sesiones WHERE id=%s",
-                (self.sesion_id,), fetch=True
-            )[0]
-            
-            ctk.CTkLabel(info, text=f"Corte: {sesion_info['nombre']}",
-                        font=("Arial", 12, "bold")).pack(padx=15, pady=(10, 5))
-            ctk.CTkLabel(info, text=f"Responsable: {sesion_info['responsable']}",
-                        font=("Arial", 10)).pack(padx=15, pady=2)
+            filas, _ = self.db.execute_query_rows(
+                """SELECT s.nombre, s.responsable, COUNT(i.id) 
+                   FROM sesiones s 
+                   LEFT JOIN items_corte i ON i.sesion_id=s.id 
+                   WHERE s.id=%s 
+                   GROUP BY s.id, s.nombre, s.responsable""",
+                (self.sesion_id,)
+            )
+            nombre, responsable, self._n_items = filas[0]
+            
+            ctk.CTkLabel(info, text=f"Corte: {nombre}",
+                        font=Fonts.BOLD_12).pack(padx=15, pady=(10, 5))
+            ctk.CTkLabel(info, text=f"Responsable: {responsable}",
+                        font=Fonts.NORMAL_10).pack(padx=15, pady=2)
         except Exception as e:
-            logger.error(f"Error cargando info sesión: {e}")
+            logger.error("Error cargando info sesión: %s", e)
         
         # Instrucciones
         instruc = ctk.CTkFrame(self, fg_color="#1F1F1F")
@@ -925,16 +1895,17 @@ class VentanaActualizarStock(ctk.CTkToplevel):
             "5. Las diferencias se recalcularán automáticamente"
         )
         
-        ctk.CTkLabel(instruc, text=instruc_text, font=("Arial", 10),
+        ctk.CTkLabel(instruc, text=instruc_text, font=Fonts.NORMAL_10,
                     justify="left", text_color="#FFD700").pack(padx=15, pady=15)
         
         # Botón cargar Excel
-        ctk.CTkButton(self, text="CARGAR EXCEL Y ACTUALIZAR",
-                     fg_color=Colors.SUCCESS, height=45, font=("Arial", 14, "bold"),
-                     command=self._cargar_y_actualizar).pack(fill="x", padx=20, pady=20)
+        self.btn_cargar = ctk.CTkButton(self, text="CARGAR EXCEL Y ACTUALIZAR",
+                                        fg_color=Colors.SUCCESS, height=45, font=Fonts.BOLD_14,
+                                        command=self._cargar_y_actualizar)
+        self.btn_cargar.pack(fill="x", padx=20, pady=20)
         
         # Info adicional
-        self.lbl_info = ctk.CTkLabel(self, text="", font=("Arial", 11))
+        self.lbl_info = ctk.CTkLabel(self, text="", font=Fonts.NORMAL_11)
         self.lbl_info.pack(pady=10)
         
         ctk.CTkButton(self, text="CANCELAR", fg_color="gray",
@@ -946,7 +1917,7 @@ class VentanaActualizarStock(ctk.CTkToplevel):
         self.lift()
         self.focus_force()
         self.attributes('-topmost', True)
-        self.update()
+        self.update_idletasks()
         
         path = filedialog.askopenfilename(
             title="Seleccionar Excel Maestro",
@@ -961,31 +1932,45 @@ class VentanaActualizarStock(ctk.CTkToplevel):
         if not path:
             return
         
+        self.lbl_info.configure(text="Procesando Excel...", text_color=Colors.WARNING)
+        self.btn_cargar.configure(state="disabled")
+        
+        # Leer el Excel en segundo plano para no congelar la ventana
+        def procesar_background():
+            try:
+                stock = Utils.calcular_stock_desde_excel(path)
+                self.after(0, lambda: self._on_excel_procesado(stock, None))
+            except Exception as e:
+                logger.error("Error procesando Excel: %s", e)
+                self.after(0, lambda err=e: self._on_excel_procesado(None, err))
+        
+        threading.Thread(target=procesar_background, daemon=True).start()
+    
+    def _on_excel_procesado(self, stock: Optional[dict], error: Optional[Exception]):
+        """Continúa la actualización en el hilo de UI con el stock ya calculado"""
+        if not self.winfo_exists():
+            return
+        
+        self.btn_cargar.configure(state="normal")
+        
         try:
-            self.lbl_info.configure(text="Procesando Excel...", text_color=Colors.WARNING)
-            self.update()
+            if error is not None:
+                raise error
             
-            # Calcular stock desde Excel
-            self.stock_calculado = Utils.calcular_stock_desde_excel(path)
+            self.stock_calculado = Utils.stock_a_decimal(stock) if stock else {}
             
             if not self.stock_calculado:
                 messagebox.showerror("Error", "No se pudo calcular stock del Excel")
                 self.lbl_info.configure(text="Error al procesar", text_color=Colors.DANGER)
                 return
             
-            # Obtener items del corte
-            items = self.db.execute_query(
-                "SELECT id, codigo FROM items_corte WHERE sesion_id=%s",
-                (self.sesion_id,), fetch=True
-            )
-            
-            if not items:
+            if not self._n_items:
                 messagebox.showwarning("Advertencia", "El corte no tiene items")
                 return
             
             # Confirmar actualización
             msg = (
-                f"Se actualizará el stock de {len(items)} items\n\n"
+                f"Se actualizará el stock de {self._n_items} items\n\n"
                 f"Stock calculado desde Excel: {len(self.stock_calculado)} códigos\n\n"
                 f"¿Desea continuar?"
             )
@@ -996,53 +1981,72 @@ class VentanaActualizarStock(ctk.CTkToplevel):
             
             # Actualizar stock
             self.lbl_info.configure(text="Actualizando stock...", text_color=Colors.ACCENT)
-            self.update()
-            
-            actualizados = 0
-            sin_stock = 0
-            
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                for item in items:
-                    codigo = Utils.limpiar_codigo(item['codigo'])
-                    stock = float(self.stock_calculado.get(codigo, 0.0))
-                    
-                    cursor.execute(
-                        "UPDATE items_corte SET stock_sistema=%s WHERE id=%s",
-                        (stock, item['id'])
-                    )
-                    
-                    if stock > 0:
-                        actualizados += 1
-                    else:
-                        sin_stock += 1
-                
-                conn.commit()
-            
-            logger.info(f"Stock actualizado: {actualizados} items con stock, {sin_stock} sin stock")
-            
-            # Mensaje de éxito
-            messagebox.showinfo(
-                "Actualización Exitosa",
-                f"Stock actualizado correctamente\n\n"
-                f"Items actualizados: {len(items)}\n"
-                f"Con stock: {actualizados}\n"
-                f"Sin stock: {sin_stock}"
-            )
-            
-            self.lbl_info.configure(text="Actualización completada", text_color=Colors.SUCCESS)
-            
-            # Actualizar UI principal
-            self.callback()
-            
-            # Cerrar ventana después de 2 segundos
-            self.after(2000, self.destroy)
+            self.btn_cargar.configure(state="disabled")
             
         except Exception as e:
-            logger.error(f"Error actualizando stock: {e}")
+            logger.error("Error actualizando stock: %s", e)
             messagebox.showerror("Error", f"Error al actualizar stock:\n{e}")
             self.lbl_info.configure(text="Error", text_color=Colors.DANGER)
+            return
+        
+        def mostrar_progreso(hechos, total):
+            self.after(0, lambda: self.lbl_info.configure(text=f"Actualizando stock... {hechos}/{total}"))
+        
+        # El cruce código -> stock se resuelve en el servidor, por lotes y fuera del hilo de UI
+        def actualizar_background():
+            try:
+                modificados = self.db.actualizar_stock_sesion(
+                    self.sesion_id, self.stock_calculado, progreso=mostrar_progreso
+                )
+                
+                # Resumen agregado en el servidor
+                (resumen,), _ = self.db.execute_query_rows(
+                    """SELECT COUNT(*), COALESCE(SUM(stock_sistema > 0), 0) 
+                       FROM items_corte WHERE sesion_id=%s""",
+                    (self.sesion_id,)
+                )
+                self.after(0, lambda: self._on_stock_actualizado(resumen, modificados, None))
+            except Exception as e:
+                logger.error("Error actualizando stock: %s", e)
+                self.after(0, lambda err=e: self._on_stock_actualizado(None, 0, err))
+        
+        threading.Thread(target=actualizar_background, daemon=True).start()
+    
+    def _on_stock_actualizado(self, resumen: Optional[tuple], modificados: int, error: Optional[Exception]):
+        """Resumen final en el hilo de UI"""
+        if not self.winfo_exists():
+            return
+        
+        self.btn_cargar.configure(state="normal")
+        
+        if error is not None:
+            messagebox.showerror("Error", f"Error al actualizar stock:\n{error}")
+            self.lbl_info.configure(text="Error", text_color=Colors.DANGER)
+            return
+        
+        total, actualizados = (int(v) for v in resumen)
+        sin_stock = total - actualizados
+        
+        logger.info("Stock actualizado: %s modificados, %s items con stock, %s sin stock",
+                    modificados, actualizados, sin_stock)
+        
+        # Mensaje de éxito
+        messagebox.showinfo(
+            "Actualización Exitosa",
+            f"Stock actualizado correctamente\n\n"
+            f"Items revisados: {total}\n"
+            f"Items con cambios: {modificados}\n"
+            f"Con stock: {actualizados}\n"
+            f"Sin stock: {sin_stock}"
+        )
+        
+        self.lbl_info.configure(text="Actualización completada", text_color=Colors.SUCCESS)
+        
+        # Actualizar UI principal
+        self.callback()
+        
+        # Cerrar ventana después de 2 segundos
+        self.after(2000, self.destroy)
 
 
 # ============================================================================
@@ -1063,7 +2067,7 @@ class VentanaConfiguracion(ctk.CTkToplevel):
         header = ctk.CTkFrame(self, fg_color=Colors.INFO)
         header.pack(fill="x")
         ctk.CTkLabel(header, text="CONFIGURACION",
-                    font=("Arial", 18, "bold"), text_color="white").pack(pady=15)
+                    font=Fonts.BOLD_18, text_color="white").pack(pady=15)
         
         # Formulario
         form = ctk.CTkFrame(self, fg_color=Colors.CARD)
@@ -1071,12 +2075,12 @@ class VentanaConfiguracion(ctk.CTkToplevel):
         
         # Intervalo de sincronización
         ctk.CTkLabel(form, text="Intervalo de Sincronizacion (segundos):",
-                    font=("Arial", 12, "bold")).pack(anchor="w", padx=20, pady=(20, 5))
+                    font=Fonts.BOLD_12).pack(anchor="w", padx=20, pady=(20, 5))
         
         ctk.CTkLabel(form, text="Tiempo entre actualizaciones automáticas de KPIs y conteos",
-                    font=("Arial", 10), text_color="gray").pack(anchor="w", padx=20)
+                    font=Fonts.NORMAL_10, text_color="gray").pack(anchor="w", padx=20)
         
-        self.entry_interval = ctk.CTkEntry(form, height=35, font=("Arial", 14))
+        self.entry_interval = ctk.CTkEntry(form, height=35, font=Fonts.NORMAL_14)
         self.entry_interval.pack(fill="x", padx=20, pady=10)
         self.entry_interval.insert(0, str(self.config['app'].get('sync_interval_seconds', 30)))
         self.entry_interval.bind("<Return>", lambda e: self._guardar())
@@ -1093,7 +2097,7 @@ class VentanaConfiguracion(ctk.CTkToplevel):
             "Valores muy bajos pueden afectar el rendimiento"
         )
         
-        ctk.CTkLabel(info_frame, text=info_text, font=("Arial", 10),
+        ctk.CTkLabel(info_frame, text=info_text, font=Fonts.NORMAL_10,
                     justify="left", text_color="#FFD700").pack(padx=15, pady=15)
         
         # Botones
@@ -1101,7 +2105,7 @@ class VentanaConfiguracion(ctk.CTkToplevel):
         btn_frame.pack(fill="x", padx=20, pady=15)
         
         ctk.CTkButton(btn_frame, text="GUARDAR", fg_color=Colors.SUCCESS,
-                     height=40, font=("Arial", 13, "bold"),
+                     height=40, font=Fonts.BOLD_13,
                      command=self._guardar).pack(side="left", fill="x", expand=True, padx=(0, 5))
         
         ctk.CTkButton(btn_frame, text="CANCELAR", fg_color="gray",
@@ -1123,13 +2127,16 @@ class VentanaConfiguracion(ctk.CTkToplevel):
                 self.entry_interval.insert(0, "30")
                 return
             
-            # Actualizar configuración
-            self.config['app']['sync_interval_seconds'] = interval
+            # Actualizar una copia: la configuración en memoria solo cambia si se guarda
+            nueva = copy.deepcopy(self.config)
+            nueva['app']['sync_interval_seconds'] = interval
             
             # Guardar en archivo
-            if ConfigManager.save(self.config):
+            if ConfigManager.save(nueva):
+                self.config = nueva
                 messagebox.showinfo("Exito", 
-                    f"Configuracion guardada.\nIntervalo de sincronizacion: {interval} segundos\n\nSe aplicara en la proxima actualizacion.")
+                    f"Configuracion guardada.\nIntervalo de sincronizacion: {interval} segundos\n\n"
+                    "Se aplicara en la proxima actualizacion.")
                 self.callback(interval)  # Pasar nuevo intervalo
                 self.destroy()
             else:
@@ -1156,7 +2163,7 @@ class VentanaEquipos(ctk.CTkToplevel):
         header.pack(fill="x", padx=10, pady=10)
         
         ctk.CTkLabel(header, text="GESTION DE EQUIPOS",
-                    font=("Arial", 18, "bold")).pack(pady=10)
+                    font=Fonts.BOLD_18).pack(pady=10)
         
         form = ctk.CTkFrame(self, fg_color=Colors.CARD)
         form.pack(fill="x", padx=10, pady=5)
@@ -1176,7 +2183,7 @@ class VentanaEquipos(ctk.CTkToplevel):
                      height=35, command=self._add_equipo).pack(fill="x", padx=15, pady=10)
         
         ctk.CTkLabel(self, text="Equipos Activos:",
-                    font=("Arial", 12, "bold")).pack(anchor="w", padx=15, pady=(10, 5))
+                    font=Fonts.BOLD_12).pack(anchor="w", padx=15, pady=(10, 5))
         
         self.scroll = ctk.CTkScrollableFrame(self)
         self.scroll.pack(fill="both", expand=True, padx=10, pady=5)
@@ -1184,40 +2191,69 @@ class VentanaEquipos(ctk.CTkToplevel):
         self._load_equipos()
     
     def _load_equipos(self):
+        """Carga completa de la lista (solo al abrir la ventana)"""
         for w in self.scroll.winfo_children():
             w.destroy()
         
-        try:
-            eqs = self.db.execute_query(
-                "SELECT id, nombre_equipo, integrantes FROM equipos WHERE activo=1 ORDER BY nombre_equipo",
-                fetch=True
-            )
-            
-            if not eqs:
-                ctk.CTkLabel(self.scroll, text="Sin equipos", 
-                           text_color="gray").pack(pady=20)
-                return
-            
-            for eq in eqs:
-                frame = ctk.CTkFrame(self.scroll, fg_color="#333")
-                frame.pack(fill="x", pady=3, padx=5)
-                
-                info_frame = ctk.CTkFrame(frame, fg_color="transparent")
-                info_frame.pack(side="left", fill="both", expand=True, padx=15, pady=10)
-                
-                ctk.CTkLabel(info_frame, text=f"Equipo {eq['nombre_equipo']}", 
-                           font=("Arial", 13, "bold"), anchor="w").pack(anchor="w")
-                
-                if eq.get('integrantes'):
-                    ctk.CTkLabel(info_frame, text=eq['integrantes'], 
-                               font=("Arial", 10), anchor="w",
-                               text_color="gray").pack(anchor="w")
-                
-                ctk.CTkButton(frame, text="X", width=30, fg_color=Colors.DANGER,
-                            command=lambda x=eq['id'], n=eq['nombre_equipo']: 
-                            self._remove_equipo(x, n)).pack(side="right", padx=10)
-        except Exception as e:
-            logger.error(f"Error cargando equipos: {e}")
+        self._filas = {}
+        self.lbl_vacio = ctk.CTkLabel(self.scroll, text="Sin equipos", text_color="gray")
+        
+        def cargar_background():
+            try:
+                eqs, _ = self.db.execute_query_rows(
+                    "SELECT id, nombre_equipo, integrantes FROM equipos WHERE activo=1 ORDER BY nombre_equipo"
+                )
+            except Exception as e:
+                logger.error("Error cargando equipos: %s", e)
+                eqs = []
+            self.after(0, lambda: self._on_equipos_cargados(eqs))
+        
+        threading.Thread(target=cargar_background, daemon=True).start()
+    
+    def _on_equipos_cargados(self, eqs: List[tuple]):
+        for eq_id, nombre, integrantes in eqs:
+            self._agregar_fila(eq_id, nombre, integrantes, ordenar=False)
+        self._actualizar_vacio()
+    
+    def _agregar_fila(self, eq_id: int, nombre: str, integrantes: Optional[str], ordenar: bool = True):
+        """Crea la fila de un equipo; con ordenar=True la ubica en orden por nombre"""
+        frame = ctk.CTkFrame(self.scroll, fg_color="#333")
+        
+        # Ubicar antes del menor nombre mayor al nuevo (mismo orden que ORDER BY)
+        antes = None
+        if ordenar:
+            clave = nombre.casefold()
+            mayores = [(n.casefold(), f) for n, f in self._filas.values() if n.casefold() > clave]
+            if mayores:
+                antes = min(mayores, key=lambda m: m[0])[1]
+        
+        if antes is not None:
+            frame.pack(fill="x", pady=3, padx=5, before=antes)
+        else:
+            frame.pack(fill="x", pady=3, padx=5)
+        
+        info_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        info_frame.pack(side="left", fill="both", expand=True, padx=15, pady=10)
+        
+        ctk.CTkLabel(info_frame, text=f"Equipo {nombre}", 
+                   font=Fonts.BOLD_13, anchor="w").pack(anchor="w")
+        
+        if integrantes:
+            ctk.CTkLabel(info_frame, text=integrantes, 
+                       font=Fonts.NORMAL_10, anchor="w",
+                       text_color="gray").pack(anchor="w")
+        
+        ctk.CTkButton(frame, text="X", width=30, fg_color=Colors.DANGER,
+                    command=lambda x=eq_id, n=nombre: 
+                    self._remove_equipo(x, n)).pack(side="right", padx=10)
+        
+        self._filas[eq_id] = (nombre, frame)
+    
+    def _actualizar_vacio(self):
+        if self._filas:
+            self.lbl_vacio.pack_forget()
+        else:
+            self.lbl_vacio.pack(pady=20)
     
     def _add_equipo(self):
         numero = self.entry_num.get().strip()
@@ -1233,37 +2269,52 @@ class VentanaEquipos(ctk.CTkToplevel):
         
         integrantes = integrantes.upper()
         
-        try:
-            self.db.execute_query(
-                "INSERT INTO equipos (nombre_equipo, integrantes) VALUES (%s, %s)",
-                (numero, integrantes)
-            )
-            
-            self.entry_num.delete(0, 'end')
-            self.entry_integrantes.delete(0, 'end')
-            self._load_equipos()
-            self.callback()
-            logger.info(f"Equipo agregado: {numero} - {integrantes}")
-        except Error as e:
-            if "Duplicate entry" in str(e):
-                messagebox.showerror("Error", "Número de equipo ya existe")
-            else:
-                messagebox.showerror("Error", f"Error: {e}")
+        def agregar_background():
+            try:
+                eq_id = self.db.execute_query(
+                    "INSERT INTO equipos (nombre_equipo, integrantes) VALUES (%s, %s)",
+                    (numero, integrantes)
+                )
+                self.after(0, lambda: self._on_equipo_agregado(eq_id, numero, integrantes))
+            except Error as e:
+                if "Duplicate entry" in str(e):
+                    self.after(0, lambda: messagebox.showerror("Error", "Número de equipo ya existe"))
+                else:
+                    self.after(0, lambda err=e: messagebox.showerror("Error", f"Error: {err}"))
+        
+        threading.Thread(target=agregar_background, daemon=True).start()
+    
+    def _on_equipo_agregado(self, eq_id: int, numero: str, integrantes: str):
+        self.entry_num.delete(0, 'end')
+        self.entry_integrantes.delete(0, 'end')
+        self._agregar_fila(eq_id, numero, integrantes)
+        self._actualizar_vacio()
+        self.callback()
+        logger.info("Equipo agregado: %s - %s", numero, integrantes)
     
     def _remove_equipo(self, eq_id: int, nombre: str):
         if not messagebox.askyesno("Confirmar", f"¿Eliminar '{nombre}'?"):
             return
         
-        try:
-            self.db.execute_query(
-                "UPDATE equipos SET activo=0 WHERE id=%s",
-                (eq_id,)
-            )
-            self._load_equipos()
-            self.callback()
-            logger.info(f"Equipo eliminado: {nombre}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error: {e}")
+        def eliminar_background():
+            try:
+                self.db.execute_query(
+                    "UPDATE equipos SET activo=0 WHERE id=%s",
+                    (eq_id,)
+                )
+                self.after(0, lambda: self._on_equipo_eliminado(eq_id, nombre))
+            except Exception as e:
+                self.after(0, lambda err=e: messagebox.showerror("Error", f"Error: {err}"))
+        
+        threading.Thread(target=eliminar_background, daemon=True).start()
+    
+    def _on_equipo_eliminado(self, eq_id: int, nombre: str):
+        fila = self._filas.pop(eq_id, None)
+        if fila:
+            fila[1].destroy()
+        self._actualizar_vacio()
+        self.callback()
+        logger.info("Equipo eliminado: %s", nombre)
 
 
 # FIN PARTE 1
@@ -1292,6 +2343,7 @@ class VentanaNuevoCorte(ctk.CTkToplevel):
         self.callback = callback
         self.df_maestro = None
         self.stock_calculado = {}
+        self.stock_series = None
         
         header = ctk.CTkFrame(self, fg_color=Colors.ACCENT)
         header.pack(fill="x")
@@ -1318,9 +2370,10 @@ class VentanaNuevoCorte(ctk.CTkToplevel):
             values=["PRINCIPAL", "SECUNDARIA"], height=35)
         self.cmb_bodega.pack(fill="x", padx=15, pady=5)
         
-        ctk.CTkButton(form, text="CARGAR EXCEL Y SELECCIONAR LINEAS", 
-                     fg_color=Colors.SUCCESS, height=45, font=("Arial", 14, "bold"),
-                     command=self._load_excel).pack(fill="x", padx=15, pady=20)
+        self.btn_cargar = ctk.CTkButton(form, text="CARGAR EXCEL Y SELECCIONAR LINEAS", 
+                                        fg_color=Colors.SUCCESS, height=45, font=("Arial", 14, "bold"),
+                                        command=self._load_excel)
+        self.btn_cargar.pack(fill="x", padx=15, pady=20)
         
         self.lbl_info = ctk.CTkLabel(form, 
             text="Hojas requeridas:\nPRODUCTOS, CONDI, MAQUI, ASCINTEC",
@@ -1346,7 +2399,7 @@ class VentanaNuevoCorte(ctk.CTkToplevel):
         self.lift()
         self.focus_force()
         self.attributes('-topmost', True)
-        self.update()
+        self.update_idletasks()
         
         path = filedialog.askopenfilename(
             title="Seleccionar Excel Maestro",
@@ -1362,62 +2415,114 @@ class VentanaNuevoCorte(ctk.CTkToplevel):
         if not path:
             return
         
+        self.lbl_info.configure(text="Procesando...", text_color=Colors.WARNING)
+        self.btn_cargar.configure(state="disabled")
+        
+        # Lectura del Excel y alta de equipos en segundo plano para no congelar la ventana
+        def cargar_background():
+            try:
+                # Abrir el libro una sola vez y reutilizarlo para todas las hojas
+                with Utils.abrir_excel(path) as libro:
+                    df_maestro = self._leer_productos(libro)
+                    
+                    stock = Utils.stock_a_decimal(Utils.calcular_stock_desde_excel(libro))
+                    
+                    # Cargar equipos desde Excel
+                    equipos_excel = Utils.cargar_equipos_desde_excel(libro)
+                
+                if equipos_excel:
+                    self._agregar_equipos_desde_excel(equipos_excel)
+                
+                self.after(0, lambda: self._on_excel_cargado(df_maestro, stock, None))
+            except Exception as e:
+                self.after(0, lambda err=e: self._on_excel_cargado(None, None, err))
+        
+        threading.Thread(target=cargar_background, daemon=True).start()
+    
+    def _on_excel_cargado(self, df_maestro: Optional[pd.DataFrame], stock: Optional[dict],
+                          error: Optional[Exception]):
+        """Continúa en el hilo de UI con el Excel ya procesado"""
+        if not self.winfo_exists():
+            return
+        
+        self.btn_cargar.configure(state="normal")
+        
         try:
-            self.lbl_info.configure(text="Procesando...", text_color=Colors.WARNING)
-            self.update()
-            
-            self.df_maestro = pd.read_excel(path, sheet_name="PRODUCTOS", dtype=str)
-            self.df_maestro.columns = self.df_maestro.columns.str.strip().str.lower()
+            if error is not None:
+                raise error
             
-            self.stock_calculado = Utils.calcular_stock_desde_excel(path)
+            self.df_maestro = df_maestro
+            self.stock_calculado = stock
+            # Serie indexada por código: búsqueda vectorizada al armar los items
+            import pandas as pd
+            self.stock_series = pd.Series(stock, dtype=object)
             
-            # Cargar equipos desde Excel
-            equipos_excel = Utils.cargar_equipos_desde_excel(path)
-            if equipos_excel:
-                self._agregar_equipos_desde_excel(equipos_excel)
+            # strip + unique vectorizados; deduplicar después de limpiar
+            lineas = sorted(self.df_maestro['deslinea'].dropna().str.strip().unique().tolist())
             
-            col_linea = 'deslinea' if 'deslinea' in self.df_maestro.columns else self.df_maestro.columns[2]
-            lineas = sorted([str(x).strip() for x in self.df_maestro[col_linea].dropna().unique()])
-            
-            logger.info(f"Excel: {len(self.df_maestro)} productos, {len(lineas)} líneas")
+            logger.info("Excel: %s productos, %s líneas", len(self.df_maestro), len(lineas))
             
             VentanaMultiSelect(self, lineas, self._save_corte)
         except Exception as e:
-            logger.error(f"Error Excel: {e}")
+            logger.error("Error Excel: %s", e)
             self.lift()
             self.attributes('-topmost', True)
             self.after(100, lambda: self.attributes('-topmost', False))
             messagebox.showerror("Error", f"Error:\n{e}")
             self.lbl_info.configure(text="Error", text_color=Colors.DANGER)
     
+    # Columnas usadas de PRODUCTOS y su posición de respaldo si falta el encabezado
+    COLUMNAS_PRODUCTOS = (('codproducto', 0), ('producto', 1), ('deslinea', 2))
+    
+    def _leer_productos(self, libro: pd.ExcelFile) -> pd.DataFrame:
+        """Lee de PRODUCTOS solo las columnas de código, nombre y línea (con nombres canónicos).
+        
+        La hoja se parsea una sola vez filtrando por nombre, como en calcular_stock_desde_excel;
+        solo un archivo sin esas cabeceras se relee tomando las que falten por posición.
+        """
+        canonicas = {nombre for nombre, _ in self.COLUMNAS_PRODUCTOS}
+        df = libro.parse("PRODUCTOS", dtype=str, usecols=lambda c: str(c).strip().lower() in canonicas)
+        df.columns = [str(c).strip().lower() for c in df.columns]
+        df = df.loc[:, ~df.columns.duplicated()]
+        if canonicas.issubset(df.columns):
+            return df
+        
+        cabecera = list(libro.parse("PRODUCTOS", nrows=0).columns)
+        normalizada = [str(c).strip().lower() for c in cabecera]
+        
+        posiciones = {
+            nombre: normalizada.index(nombre) if nombre in normalizada else pos
+            for nombre, pos in self.COLUMNAS_PRODUCTOS
+        }
+        
+        df = libro.parse("PRODUCTOS", dtype=str, usecols=sorted(set(posiciones.values())))
+        df = df.rename(columns={cabecera[pos]: nombre for nombre, pos in posiciones.items()})
+        return df
+    
     def _agregar_equipos_desde_excel(self, equipos_data: List[dict]):
         """Agrega equipos desde Excel a la BD si no existen"""
         try:
-            equipos_agregados = 0
-            for equipo in equipos_data:
-                try:
-                    # Si es string (formato antiguo), solo agregar el número
-                    if isinstance(equipo, str):
-                        self.db.execute_query(
-                            "INSERT INTO equipos (nombre_equipo) VALUES (%s)",
-                            (equipo,)
-                        )
-                    # Si es dict con número e integrantes
-                    elif isinstance(equipo, dict):
-                        self.db.execute_query(
-                            "INSERT INTO equipos (nombre_equipo, integrantes) VALUES (%s, %s)",
-                            (equipo.get('numero', ''), equipo.get('integrantes', ''))
-                        )
-                    equipos_agregados += 1
-                    logger.info(f"Equipo agregado desde Excel: {equipo}")
-                except Error as e:
-                    if "Duplicate entry" not in str(e):
-                        logger.warning(f"Error agregando equipo {equipo}: {e}")
+            # Si es string (formato antiguo) solo el número; si es dict, número e integrantes
+            filas = [
+                (equipo, None) if isinstance(equipo, str)
+                else (equipo.get('numero', ''), equipo.get('integrantes', ''))
+                for equipo in equipos_data
+                if isinstance(equipo, (str, dict))
+            ]
+            if not filas:
+                return
+            
+            # Un solo lote; los equipos existentes se dejan como están
+            equipos_agregados = self.db.execute_many(
+                """INSERT INTO equipos (nombre_equipo, integrantes) VALUES (%s, %s)
+                   ON DUPLICATE KEY UPDATE id=id""",
+                filas
+            )
             
             if equipos_agregados > 0:
-                logger.info(f"Total equipos agregados desde Excel: {equipos_agregados}")
+                logger.info("Total equipos agregados desde Excel: %s", equipos_agregados)
         except Exception as e:
-            logger.error(f"Error procesando equipos desde Excel: {e}")
+            logger.error("Error procesando equipos desde Excel: %s", e)
     
     def _save_corte(self, lineas_sel: List[str]):
         if not lineas_sel:
@@ -1428,37 +2533,42 @@ class VentanaNuevoCorte(ctk.CTkToplevel):
             return
         
         try:
-            sesion_id = self.db.execute_query(
-                "INSERT INTO sesiones (nombre, fecha, responsable, bodega) VALUES (%s, %s, %s, %s)",
-                (self.en_nombre.get().strip(), datetime.now(), 
-                 self.en_responsable.get().strip(), self.cmb_bodega.get())
-            )
+            # Filtrar por líneas seleccionadas con una máscara vectorizada
+            # (_leer_productos ya resolvió los encabezados a nombres canónicos)
+            lineas = self.df_maestro['deslinea'].astype(str).str.strip()
+            mask = lineas.isin(frozenset(linea.strip() for linea in lineas_sel))
+            codigos = Utils.limpiar_codigo(self.df_maestro.loc[mask, 'codproducto'])
             
-            col_codigo = 'codproducto' if 'codproducto' in self.df_maestro.columns else self.df_maestro.columns[0]
-            col_nombre = 'producto' if 'producto' in self.df_maestro.columns else self.df_maestro.columns[1]
-            col_linea = 'deslinea' if 'deslinea' in self.df_maestro.columns else self.df_maestro.columns[2]
-            
-            items_data = []
-            for _, row in self.df_maestro.iterrows():
-                linea = str(row[col_linea]).strip()
-                if linea in lineas_sel:
-                    codigo = Utils.limpiar_codigo(row[col_codigo])
-                    # Convertir explícitamente a float de Python
-                    stock = float(self.stock_calculado.get(codigo, 0.0))
-                    items_data.append((
-                        sesion_id, codigo, str(row[col_nombre]).strip(), 
-                        linea, stock
-                    ))
+            # Un solo registro por código (clave única sesion_id, codigo)
+            unicos = ~codigos.duplicated()
+            codigos = codigos[unicos]
+            nombres = self.df_maestro.loc[mask, 'producto'].astype(str).str.strip()[unicos]
+            lineas = lineas[mask][unicos]
+            stocks = self.stock_series.reindex(codigos.values, fill_value=0)
             
             with self.db.get_connection() as conn:
+                # Sesión e items en una sola transacción: un único commit (rollback en get_connection)
+                conn.start_transaction()
                 cursor = conn.cursor()
-                cursor.executemany(
-                    "INSERT INTO items_corte (sesion_id, codigo, producto, linea, stock_sistema) VALUES (%s,%s,%s,%s,%s)",
+                cursor.execute(
+                    "INSERT INTO sesiones (nombre, fecha, responsable, bodega) VALUES (%s, %s, %s, %s)",
+                    (self.en_nombre.get().strip(), datetime.now(), 
+                     self.en_responsable.get().strip(), self.cmb_bodega.get())
+                )
+                sesion_id = cursor.lastrowid
+                
+                items_data = list(zip(
+                    repeat(sesion_id), codigos.tolist(), nombres.tolist(), lineas.tolist(), stocks.tolist()
+                ))
+                self.db.insertar_masivo(
+                    cursor, "items_corte",
+                    ("sesion_id", "codigo", "producto", "linea", "stock_sistema"),
                     items_data
                 )
                 conn.commit()
+                cursor.close()
             
-            logger.info(f"Corte creado: ID={sesion_id}, Items={len(items_data)}")
+            logger.info("Corte creado: ID=%s, Items=%s", sesion_id, len(items_data))
             
             # Forzar ventana al frente para mensaje de éxito
             self.lift()
@@ -1471,7 +2581,7 @@ class VentanaNuevoCorte(ctk.CTkToplevel):
             self.withdraw()
             self.after(100, self.destroy)
         except Exception as e:
-            logger.error(f"Error creando corte: {e}")
+            logger.error("Error creando corte: %s", e)
             self.lift()
             self.attributes('-topmost', True)
             self.after(100, lambda: self.attributes('-topmost', False))
@@ -1481,8 +2591,25 @@ class VentanaNuevoCorte(ctk.CTkToplevel):
 # APLICACIÓN PRINCIPAL - PARTE 1: INIT Y SETUP
 # ============================================================================
 class InventarioApp(ctk.CTk):
+    # Filas visibles por pestaña de lista y criterio de cada una (común a sync y filtro).
+    # Mismo LIMIT 100 que las consultas originales; la tabla ttk las muestra todas
+    LIMITE_LISTA = 100
+    SQL_LISTA = {
+        'pendientes': ("codigo, producto, NULL, stock_sistema",
+                       "conteo_fisico=0 AND stock_sistema > 0"),
+        'diferencias': ("codigo, producto, diferencia, stock_sistema",
+                        "diferencia!=0 AND conteo_fisico>0"),
+    }
+    # Estado de una fila de búsqueda: 0=pendiente, 1=cuadrado, 2=contado -> (texto, tag)
+    ESTADOS_BUSQUEDA = (
+        ("PENDIENTE", "pendiente"),
+        ("CUADRADO: {c:.0f}", "cuadrado"),
+        ("CONTADO: {c:.0f} | Dif: {d:+.0f}", "contado"),
+    )
+    
     def __init__(self):
         super().__init__()
+        Fonts.iniciar()
         
         self.title("SISTEMA DE INVENTARIO - MySQL Multi-Usuario")
         self.geometry("1350x700")
@@ -1502,7 +2629,7 @@ class InventarioApp(ctk.CTk):
             self.config = ConfigManager.load()
             self.backup_mgr = BackupManager(self.db)
         except Exception as e:
-            logger.error(f"Error crítico: {e}")
+            logger.error("Error crítico: %s", e)
             messagebox.showerror("Error Crítico", 
                 f"No se pudo conectar a MySQL:\n{e}\n\nVerifique que MySQL esté corriendo.")
             sys.exit(1)
@@ -1510,7 +2637,11 @@ class InventarioApp(ctk.CTk):
         # Variables de estado
         self.sesion_id = None
         self.equipo_id = None
+        self._equipo_nombres = {}  # {id: nombre_equipo} para resolver el historial sin JOIN
         self.filtro_lineas = []
+        self._lineas_cache = {}  # {sesion_id: [lineas]}; se invalida al dar de alta un producto
+        # (fragmento SQL, parámetros) del filtro; se reemplaza entero para que el hilo de sync lo lea consistente
+        self._filtro_sql = ("", ())
         self.producto_actual = {
             "codigo": None, "nombre": None, "linea": None, 
             "stock": 0.0, "es_nuevo": False
@@ -1519,17 +2650,39 @@ class InventarioApp(ctk.CTk):
         # Control de ventanas
         self.ventana_abierta = False
         self.console_visible = False
+        self._exportando = False  # Evita lanzar dos exportaciones a la vez
         
         # Control de sincronización
-        self.sync_running = False
-        self.sync_thread = None
+        self._sync_after_id = None
+        self._refresh_after_id = None  # Refresco forzado pendiente (agrupa llamadas seguidas)
         self.sync_interval_seconds = self.config['app'].get('sync_interval_seconds', 30)
         self.sync_counter = 0  # Contador para reducir actualizaciones pesadas
         self.sync_in_progress = False  # Flag para evitar sincronizaciones simultáneas
+        # Un único hilo persistente para los ciclos (nunca más de uno en vuelo)
+        self._sync_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync-ciclo")
+        # Las consultas de cada ciclo son independientes: una conexión del pool cada una
+        self._sync_consultas = ThreadPoolExecutor(max_workers=DBManager.CONSULTAS_SYNC, thread_name_prefix="sync")
+        # Un solo escritor para los conteos: se guardan en orden de escaneo (FIFO)
+        # sin arrancar un hilo nuevo por cada lectura
+        self._guardado_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="guardado")
+        self._ultimo_guardado = None  # Future del último conteo encolado (FIFO: marca el final de la cola)
+        # Aviso de cierre para los hilos: una vez activo no publican nada en Tk
+        self._cerrando = threading.Event()
+        # Cerrar la ventana pasa por destroy(): espera la cola de guardado sin bloquear Tk
+        self.protocol("WM_DELETE_WINDOW", self.destroy)
         
         # Data cache para tabs
         self.data_pendientes = []
         self.data_diferencias = []
+        # Último contenido volcado en cada lista, para no redibujar si no cambió
+        self._ultimo_render = {}
+        # Filas del historial ya construidas, para reutilizarlas en cada refresco
+        self._filas_historial = []  # [(frame, lbl_prod, lbl_cant, lbl_dif, lbl_equipo, lbl_fecha)] por posición
+        
+        # Búsquedas diferidas hasta que se deja de escribir
+        self._busqueda_after = {}
+        self._busqueda_seq = 0
+        self._filtro_tab_seq = {'pendientes': 0, 'diferencias': 0}
         
         # Construir UI
         self._setup_ui()
@@ -1538,6 +2691,9 @@ class InventarioApp(ctk.CTk):
         # Iniciar sincronización automática
         self._start_sync()
         
+        # Tonos listos antes del primer escaneo
+        threading.Thread(target=Sonidos.precargar, daemon=True).start()
+        
         logger.info("App iniciada V7.0")
     
     def _setup_ui(self):
@@ -1785,91 +2941,124 @@ class InventarioApp(ctk.CTk):
         tabs_container = ctk.CTkFrame(self.main, fg_color="transparent")
         tabs_container.pack(fill="both", expand=True, pady=5)
         
-        self.tabs = ctk.CTkTabview(tabs_container, height=180)
+        self.tabs = ctk.CTkTabview(tabs_container, height=180, command=self._on_tab_change)
         self.tabs.pack(fill="both", expand=True)
+        self._estilo_tablas()
+        
+        # Pendientes y Diferencias se construyen al abrirlas por primera vez
+        self.tv_pendientes = None
+        self.tv_diferencias = None
+        self._tabs_diferidas = {
+            "PENDIENTES": self._crear_tab_pendientes,
+            "DIFERENCIAS": self._crear_tab_diferencias,
+        }
         
         # Tab Búsqueda
         t1 = self.tabs.add("BUSQUEDA")
         self.en_busqueda = ctk.CTkEntry(t1, placeholder_text="Buscar...", height=30)
         self.en_busqueda.pack(fill="x", padx=10, pady=5)
-        self.en_busqueda.bind("<KeyRelease>", lambda e: self._filtrar_busqueda())
-        
-        # Header de tabla
-        header_busq = ctk.CTkFrame(t1, fg_color="#1F1F1F", height=30)
-        header_busq.pack(fill="x", padx=10, pady=(5, 0))
-        header_busq.pack_propagate(False)
-        
-        ctk.CTkLabel(header_busq, text="CÓDIGO", font=("Arial", 9, "bold"),
-                    width=100, anchor="w").pack(side="left", padx=5)
-        ctk.CTkLabel(header_busq, text="PRODUCTO", font=("Arial", 9, "bold"),
-                    anchor="w").pack(side="left", fill="x", expand=True, padx=5)
-        ctk.CTkLabel(header_busq, text="STOCK", font=("Arial", 9, "bold"),
-                    width=80, anchor="center").pack(side="right", padx=(0, 5))
-        ctk.CTkLabel(header_busq, text="ESTADO", font=("Arial", 9, "bold"),
-                    width=180, anchor="center").pack(side="right", padx=5)
-        
-        self.scroll_busqueda = ctk.CTkScrollableFrame(t1)
-        self.scroll_busqueda.pack(fill="both", expand=True, padx=10, pady=(0, 5))
-        
-        # Tab Pendientes
-        t2 = self.tabs.add("PENDIENTES")
+        self.en_busqueda.bind("<KeyRelease>", 
+            lambda e: self._debounce("busqueda", self._filtrar_busqueda))
+        
+        self.tv_busqueda = self._crear_tabla(t1, (
+            ("codigo", "CÓDIGO", 100, "w"),
+            ("producto", "PRODUCTO", None, "w"),
+            ("estado", "ESTADO", 180, "center"),
+            ("stock", "STOCK", 80, "center"),
+        ))
+        self.tv_busqueda.tag_configure("pendiente", background="#2B2B2B", foreground="#FFD54F")
+        self.tv_busqueda.tag_configure("cuadrado", background="#1F4D2E", foreground="#4CAF50")
+        self.tv_busqueda.tag_configure("contado", background="#4D3D1F", foreground="#FFA726")
         
+        for nombre in self._tabs_diferidas:
+            self.tabs.add(nombre)
+    
+    def _on_tab_change(self):
+        """Construye el contenido de una pestaña diferida la primera vez que se abre"""
+        constructor = self._tabs_diferidas.pop(self.tabs.get(), None)
+        if constructor:
+            constructor(self.tabs.tab(self.tabs.get()))
+            self._update_tabs_ui()
+    
+    def _crear_tab_pendientes(self, t2):
+        """Contenido de la pestaña Pendientes"""
         # Barra superior con botón y búsqueda
         top_pend = ctk.CTkFrame(t2, fg_color="transparent")
         top_pend.pack(fill="x", padx=10, pady=5)
         ctk.CTkButton(top_pend, text="REFRESCAR", height=28, width=100,
-                     command=self._load_pendientes).pack(side="left", padx=(0, 5))
+                     command=self._refresh_all).pack(side="left", padx=(0, 5))
         self.en_buscar_pend = ctk.CTkEntry(top_pend, placeholder_text="Filtrar...", height=28)
         self.en_buscar_pend.pack(side="left", fill="x", expand=True)
         self.en_buscar_pend.bind("<KeyRelease>", 
-            lambda e: self._filtrar_precalc(self.en_buscar_pend.get(), 
-                                           self.scroll_pendientes, self.data_pendientes))
-        
-        # Header de tabla
-        header_pend = ctk.CTkFrame(t2, fg_color="#1F1F1F", height=30)
-        header_pend.pack(fill="x", padx=10, pady=(5, 0))
-        header_pend.pack_propagate(False)
-        
-        ctk.CTkLabel(header_pend, text="CÓDIGO", font=("Arial", 9, "bold"),
-                    width=100, anchor="w").pack(side="left", padx=5)
-        ctk.CTkLabel(header_pend, text="PRODUCTO", font=("Arial", 9, "bold"),
-                    anchor="w").pack(side="left", fill="x", expand=True, padx=5)
-        ctk.CTkLabel(header_pend, text="STOCK", font=("Arial", 9, "bold"),
-                    width=80, anchor="center").pack(side="right", padx=5)
-        
-        self.scroll_pendientes = ctk.CTkScrollableFrame(t2)
-        self.scroll_pendientes.pack(fill="both", expand=True, padx=10, pady=(0, 5))
-        
-        # Tab Diferencias
-        t3 = self.tabs.add("DIFERENCIAS")
+            lambda e: self._debounce("pendientes", lambda: self._filtrar_tab("pendientes")))
         
+        self.tv_pendientes = self._crear_tabla(t2, (
+            ("codigo", "CÓDIGO", 100, "w"),
+            ("producto", "PRODUCTO", None, "w"),
+            ("stock", "STOCK", 80, "center"),
+        ))
+    
+    def _crear_tab_diferencias(self, t3):
+        """Contenido de la pestaña Diferencias"""
         # Barra superior con botón y búsqueda
         top_dif = ctk.CTkFrame(t3, fg_color="transparent")
         top_dif.pack(fill="x", padx=10, pady=5)
         ctk.CTkButton(top_dif, text="REFRESCAR", height=28, width=100,
-                     command=self._load_diferencias).pack(side="left", padx=(0, 5))
+                     command=self._refresh_all).pack(side="left", padx=(0, 5))
         self.en_buscar_dif = ctk.CTkEntry(top_dif, placeholder_text="Filtrar...", height=28)
         self.en_buscar_dif.pack(side="left", fill="x", expand=True)
         self.en_buscar_dif.bind("<KeyRelease>", 
-            lambda e: self._filtrar_precalc(self.en_buscar_dif.get(), 
-                                           self.scroll_diferencias, self.data_diferencias))
-        
-        # Header de tabla
-        header_dif = ctk.CTkFrame(t3, fg_color="#1F1F1F", height=30)
-        header_dif.pack(fill="x", padx=10, pady=(5, 0))
-        header_dif.pack_propagate(False)
-        
-        ctk.CTkLabel(header_dif, text="CÓDIGO", font=("Arial", 9, "bold"),
-                    width=100, anchor="w").pack(side="left", padx=5)
-        ctk.CTkLabel(header_dif, text="PRODUCTO", font=("Arial", 9, "bold"),
-                    anchor="w").pack(side="left", fill="x", expand=True, padx=5)
-        ctk.CTkLabel(header_dif, text="STOCK", font=("Arial", 9, "bold"),
-                    width=80, anchor="center").pack(side="right", padx=(0, 5))
-        ctk.CTkLabel(header_dif, text="DIFERENCIA", font=("Arial", 9, "bold"),
-                    width=100, anchor="center").pack(side="right", padx=5)
-        
-        self.scroll_diferencias = ctk.CTkScrollableFrame(t3)
-        self.scroll_diferencias.pack(fill="both", expand=True, padx=10, pady=(0, 5))
+            lambda e: self._debounce("diferencias", lambda: self._filtrar_tab("diferencias")))
+        
+        self.tv_diferencias = self._crear_tabla(t3, (
+            ("codigo", "CÓDIGO", 100, "w"),
+            ("producto", "PRODUCTO", None, "w"),
+            ("diferencia", "DIFERENCIA", 100, "center"),
+            ("stock", "STOCK", 80, "center"),
+        ))
+        self.tv_diferencias.tag_configure("faltante", foreground=Colors.DANGER)
+        self.tv_diferencias.tag_configure("sobrante", foreground=Colors.WARNING)
+    
+    def _estilo_tablas(self):
+        """Tema oscuro para las tablas ttk, acorde a la interfaz CTk"""
+        estilo = ttk.Style(self)
+        estilo.theme_use("clam")
+        estilo.configure("Inventario.Treeview", background="#2B2B2B", fieldbackground="#2B2B2B",
+                         foreground="white", rowheight=26, font=("Arial", 9), borderwidth=0)
+        estilo.configure("Inventario.Treeview.Heading", background="#1F1F1F", foreground="white",
+                         font=("Arial", 9, "bold"), relief="flat")
+        estilo.map("Inventario.Treeview", background=[("selected", "#444")])
+        estilo.map("Inventario.Treeview.Heading", background=[("active", "#333")])
+    
+    def _crear_tabla(self, parent, columnas):
+        """Tabla ttk.Treeview con scrollbar de CTk.
+        
+        columnas: (id, título, ancho, anchor); ancho None = la columna se estira.
+        Las filas llevan iid automático (puede haber códigos repetidos en un corte);
+        un clic carga en el formulario el valor de la columna "codigo".
+        """
+        marco = ctk.CTkFrame(parent, fg_color="transparent")
+        marco.pack(fill="both", expand=True, padx=10, pady=5)
+        
+        tabla = ttk.Treeview(marco, columns=[c[0] for c in columnas], show="headings",
+                             style="Inventario.Treeview", selectmode="browse")
+        for col, titulo, ancho, anchor in columnas:
+            tabla.heading(col, text=titulo, anchor=anchor)
+            tabla.column(col, width=ancho or 200, anchor=anchor, stretch=ancho is None)
+        
+        barra = ctk.CTkScrollbar(marco, command=tabla.yview)
+        tabla.configure(yscrollcommand=barra.set)
+        barra.pack(side="right", fill="y")
+        tabla.pack(side="left", fill="both", expand=True)
+        
+        tabla.bind("<ButtonRelease-1>", self._on_click_tabla)
+        return tabla
+    
+    def _on_click_tabla(self, event):
+        """Carga en el formulario el código de la fila clickeada"""
+        fila = event.widget.identify_row(event.y)
+        if fila:
+            self._cargar_desde_lista(str(event.widget.set(fila, "codigo")))
     
     def _create_historial_panel(self):
         """Panel derecho de historial"""
@@ -1916,21 +3105,17 @@ class InventarioApp(ctk.CTk):
             self.cmb_sesion.configure(values=[f"{s['id']} - {s['nombre']}" for s in ses])
             
             # Equipos
-            eqs = self.db.execute_query(
-                "SELECT id, nombre_equipo, integrantes FROM equipos WHERE activo=1 ORDER BY nombre_equipo",
-                fetch=True
+            eqs, _ = self.db.execute_query_rows(
+                "SELECT id, nombre_equipo, integrantes FROM equipos WHERE activo=1 ORDER BY nombre_equipo"
             )
             # Crear diccionario con formato "Equipo X - NOMBRES"
-            self.equipos_dict = {}
-            equipos_display = []
-            for e in eqs:
-                integrantes = e.get('integrantes', '')
-                if integrantes:
-                    display = f"Equipo {e['nombre_equipo']} - {integrantes}"
-                else:
-                    display = f"Equipo {e['nombre_equipo']}"
-                self.equipos_dict[display] = e['id']
-                equipos_display.append(display)
+            pares = [
+                (f"Equipo {nombre} - {integrantes}" if integrantes else f"Equipo {nombre}", eq_id)
+                for eq_id, nombre, integrantes in eqs
+            ]
+            equipos_display = [display for display, _ in pares]
+            self.equipos_dict = dict(pares)
+            self._equipo_nombres.update((eq_id, nombre) for eq_id, nombre, _ in eqs)
             
             self.cmb_equipo.configure(values=equipos_display)
             if equipos_display:
@@ -1939,7 +3124,7 @@ class InventarioApp(ctk.CTk):
             
             self._log("Datos iniciales cargados")
         except Exception as e:
-            logger.error(f"Error cargando datos: {e}")
+            logger.error("Error cargando datos: %s", e)
     
     def _new_corte(self):
         VentanaNuevoCorte(self, self.db, self._on_corte_created)
@@ -1994,12 +3179,12 @@ class InventarioApp(ctk.CTk):
     def _on_select_sesion(self, val):
         try:
             self.sesion_id = int(val.split(" - ")[0])
-            self.filtro_lineas = []
+            self._set_filtro_lineas([])
             self._check_status()
             self._refresh_all()
             self._log(f"Sesión seleccionada: {self.sesion_id}")
         except Exception as e:
-            logger.error(f"Error seleccionando sesión: {e}")
+            logger.error("Error seleccionando sesión: %s", e)
     
     def _on_select_equipo(self, val):
         self.equipo_id = self.equipos_dict.get(val)
@@ -2017,133 +3202,193 @@ class InventarioApp(ctk.CTk):
     # ========================================================================
     
     def _start_sync(self):
-        """Inicia sincronización en segundo plano"""
-        self.sync_running = True
-        self.sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
-        self.sync_thread.start()
+        """Inicia sincronización automática programada con el reloj de Tk"""
+        self._sync_after_id = self.after(self.sync_interval_seconds * 1000, self._sync_tick)
         self._log("Sincronización automática iniciada")
     
-    def _sync_loop(self):
-        """Loop de sincronización automática"""
-        while self.sync_running:
-            try:
-                time.sleep(self.sync_interval_seconds)
-                
-                if self.sesion_id:
-                    # Actualizar en UI thread
-                    self.after(0, self._sync_update)
-            except Exception as e:
-                logger.error(f"Error sync: {e}")
+    def _sync_tick(self):
+        """Dispara un ciclo de sincronización y programa el siguiente"""
+        try:
+            if self.sesion_id:
+                self._sync_update()
+        except Exception as e:
+            logger.error("Error sync: %s", e)
+        finally:
+            self._sync_after_id = self.after(self.sync_interval_seconds * 1000, self._sync_tick)
     
     def _sync_update(self):
         """Actualiza datos desde DB (iniciado desde UI thread, ejecuta en background)"""
-        # Evitar múltiples sincronizaciones simultáneas
-        if self.sync_in_progress:
+        # Evitar múltiples sincronizaciones simultáneas (y no encolar nada durante el cierre)
+        if self.sync_in_progress or self._cerrando.is_set():
             return
         
         self.sync_in_progress = True
-        # Ejecutar actualización en hilo separado para no bloquear UI
-        threading.Thread(target=self._sync_update_background, daemon=True).start()
+        # Ejecutar actualización en el hilo de sincronización para no bloquear UI
+        self._sync_worker.submit(self._sync_update_background)
+    
+    def _publicar(self, funcion, *args):
+        """Encola una llamada en el hilo de Tk desde un hilo de fondo; no hace nada durante el cierre"""
+        if self._cerrando.is_set():
+            return
+        try:
+            self.after(0, funcion, *args)
+        except (RuntimeError, TclError):
+            pass  # La ventana se destruyó entre la comprobación y el after()
     
     def _sync_update_background(self):
         """Ejecuta actualización en background thread"""
-        if not self.sesion_id:
+        if not self.sesion_id or self._cerrando.is_set():
+            self.sync_in_progress = False
             return
             
         try:
-            self.after(0, lambda: self.lbl_sync.configure(text="Actualizando..."))
+            self._publicar(lambda: self.lbl_sync.configure(text="Actualizando..."))
             
             # === Consultas DB (en background thread) ===
             
-            # 1. KPIs
-            where = "WHERE sesion_id=%s"
-            params = [self.sesion_id]
+            # Se lanzan en paralelo; la latencia del ciclo es la de la consulta más lenta
+            # Forma fija en cada ciclo: sentencias preparadas, parseadas una vez por conexión
+            consultar = lambda q, p: self._sync_consultas.submit(self.db.execute_query_preparada, q, p)
             
-            if self.filtro_lineas:
-                where += f" AND linea IN ({','.join(['%s']*len(self.filtro_lineas))})"
-                params.extend(self.filtro_lineas)
+            # Filtro de líneas común a KPIs, pendientes y diferencias (precalculado)
+            filtro, p_lineas = self._filtro_sql
             
+            # 1. KPIs
+            # Con stock_sistema > 0, comparar las columnas del índice equivale a evaluar la diferencia
             q_kpis = f"""SELECT COUNT(*) as total,
                     COUNT(CASE WHEN conteo_fisico>0 THEN 1 END) as contados,
-                    COUNT(CASE WHEN (conteo_fisico-stock_sistema)<0 AND conteo_fisico>0 THEN 1 END) as faltantes,
-                    COUNT(CASE WHEN (conteo_fisico-stock_sistema)>0 THEN 1 END) as sobrantes,
-                    COUNT(CASE WHEN (conteo_fisico-stock_sistema)=0 AND conteo_fisico>0 THEN 1 END) as exactos
-                FROM items_corte {where} AND stock_sistema > 0"""
-            
-            kpis = self.db.execute_query(q_kpis, tuple(params), fetch=True)[0]
-            
-            # 2. Pendientes
-            q_pend = "SELECT codigo, producto, stock_sistema FROM items_corte WHERE sesion_id=%s AND conteo_fisico=0 AND stock_sistema > 0"
-            p_pend = [self.sesion_id]
-            if self.filtro_lineas:
-                q_pend += f" AND linea IN ({','.join(['%s']*len(self.filtro_lineas))})"
-                p_pend.extend(self.filtro_lineas)
-            q_pend += " LIMIT 100"
-            pends = self.db.execute_query(q_pend, tuple(p_pend), fetch=True)
-            data_pend = [(x['codigo'], x['producto'], float(x['stock_sistema']) if x['stock_sistema'] else 0) for x in pends]
-            
-            # 3. Diferencias
-            q_dif = """SELECT codigo, producto, diferencia, stock_sistema 
-                       FROM items_corte WHERE sesion_id=%s AND diferencia!=0 AND conteo_fisico>0"""
-            p_dif = [self.sesion_id]
-            if self.filtro_lineas:
-                q_dif += f" AND linea IN ({','.join(['%s']*len(self.filtro_lineas))})"
-                p_dif.extend(self.filtro_lineas)
-            q_dif += " LIMIT 100"
-            difs = self.db.execute_query(q_dif, tuple(p_dif), fetch=True)
-            data_dif = [(x['codigo'], x['producto'], x['diferencia'], float(x['stock_sistema']) if x['stock_sistema'] else 0) for x in difs]
-            
-            # 4. Historial
-            movs = self.db.execute_query(
-                """SELECT i.codigo, i.producto, i.conteo_fisico, i.diferencia, 
-                          i.fecha_conteo, e.nombre_equipo
-                   FROM items_corte i 
-                   LEFT JOIN equipos e ON i.ultimo_equipo_id = e.id
-                   WHERE i.sesion_id=%s AND i.conteo_fisico>0 
-                   ORDER BY i.fecha_conteo DESC LIMIT 15""",
-                (self.sesion_id,), fetch=True
-            )
+                    COUNT(CASE WHEN conteo_fisico<stock_sistema AND conteo_fisico>0 THEN 1 END) as faltantes,
+                    COUNT(CASE WHEN conteo_fisico>stock_sistema THEN 1 END) as sobrantes,
+                    COUNT(CASE WHEN conteo_fisico=stock_sistema THEN 1 END) as exactos
+                FROM items_corte WHERE sesion_id=%s{filtro} AND stock_sistema > 0"""
             
-            # === Actualizar UI (desde main thread) ===
+            f_kpis = consultar(q_kpis, (self.sesion_id, *p_lineas))
+            
+            # 2. Pendientes y diferencias en un solo viaje (UNION ALL con discriminador)
+            cols_p, pred_p = self.SQL_LISTA['pendientes']
+            cols_d, pred_d = self.SQL_LISTA['diferencias']
+            q_tabs = f"""(SELECT 'P' as tipo, {cols_p}
+                          FROM items_corte
+                          WHERE sesion_id=%s AND {pred_p}{filtro}
+                          LIMIT {self.LIMITE_LISTA})
+                         UNION ALL
+                         (SELECT 'D', {cols_d}
+                          FROM items_corte
+                          WHERE sesion_id=%s AND {pred_d}{filtro}
+                          LIMIT {self.LIMITE_LISTA})"""
+            f_tabs = consultar(q_tabs, (self.sesion_id, *p_lineas, self.sesion_id, *p_lineas))
             
-            # KPIs
-            if kpis['total'] > 0:
-                avance = (kpis['contados'] / kpis['total']) * 100
-                self.after(0, lambda: self.kpi_avance.configure(text=f"{avance:.1f}%"))
-                self.after(0, lambda: self.kpi_pendientes.configure(text=str(kpis['total'] - kpis['contados'])))
+            # 3. Historial (el nombre del equipo se resuelve con la cache local)
+            f_movs = consultar(
+                """SELECT codigo, producto, conteo_fisico, diferencia, 
+                          fecha_conteo, ultimo_equipo_id
+                   FROM items_corte 
+                   WHERE sesion_id=%s AND conteo_fisico>0 
+                   ORDER BY fecha_conteo DESC LIMIT 15""",
+                (self.sesion_id,)
+            )
             
-            if kpis['contados'] > 0:
-                exactitud = (kpis['exactos'] / kpis['contados']) * 100
-                self.after(0, lambda: self.kpi_exactitud.configure(text=f"{exactitud:.1f}%"))
+            total, contados, faltantes, sobrantes, exactos = f_kpis.result()[0]
+            # Filas listas para mostrar (producto ya recortado)
+            data_pend = []
+            data_dif = []
+            for tipo, *fila in f_tabs.result():
+                (data_pend if tipo == 'P' else data_dif).append(self._fila_lista(*fila))
+            movs, equipos_nuevos = self._resolver_equipos(f_movs.result())
             
-            self.after(0, lambda: self.kpi_faltantes.configure(text=str(kpis['faltantes'])))
-            self.after(0, lambda: self.kpi_sobrantes.configure(text=str(kpis['sobrantes'])))
-            self.after(0, lambda: self.kpi_total.configure(text=str(kpis['total'])))
+            # === Actualizar UI (desde main thread) ===
             
             # Tabs y Historial - solo actualizar cada 3 ciclos para reducir carga
             self.sync_counter += 1
             
-            # Siempre actualizar cache de datos
-            self.data_pendientes = data_pend
-            self.data_diferencias = data_dif
+            # Todo el ciclo se aplica en un único callback de Tk
+            snapshot = {
+                'avance': None,
+                'pendientes': None,
+                'exactitud': None,
+                'faltantes': str(faltantes),
+                'sobrantes': str(sobrantes),
+                'total': str(total),
+                'data_pend': data_pend,
+                'data_dif': data_dif,
+                'movs': movs,
+                'equipos_nuevos': equipos_nuevos,
+                # Solo recrear widgets cada 3 sincronizaciones (90 segundos con intervalo de 30s)
+                'refrescar_tabs': self.sync_counter % 3 == 0,
+                'sync_ts': Utils.hora_actual(),
+            }
             
-            # Solo recrear widgets cada 3 sincronizaciones (90 segundos con intervalo de 30s)
-            if self.sync_counter % 3 == 0:
-                self.after(0, lambda: self._update_tabs_ui())
-                self.after(0, lambda: self._update_historial_ui(movs))
+            if total > 0:
+                snapshot['avance'] = f"{(contados / total) * 100:.1f}%"
+                snapshot['pendientes'] = str(total - contados)
             
-            # Status
-            self.after(0, lambda: self.lbl_sync.configure(
-                text=f"Sincronizado {datetime.now().strftime('%H:%M:%S')}"
-            ))
+            if contados > 0:
+                snapshot['exactitud'] = f"{(exactos / contados) * 100:.1f}%"
+            
+            self._publicar(self._apply_sync_snapshot, snapshot)
             
         except Exception as e:
-            logger.error(f"Error sync_update: {e}")
-            self.after(0, lambda: self.lbl_sync.configure(text="Error sync"))
+            # Durante el cierre las consultas canceladas llegan aquí como CancelledError
+            if self._cerrando.is_set():
+                return
+            logger.error("Error sync_update: %s", e)
+            self._publicar(lambda: self.lbl_sync.configure(text="Error sync"))
         finally:
             # Liberar flag para permitir siguiente sincronización
             self.sync_in_progress = False
     
+    def _resolver_equipos(self, movs):
+        """Cambia ultimo_equipo_id por el nombre del equipo; solo consulta los ids que no están en cache.
+        
+        Corre en el hilo de sincronización: lee una copia del cache y no lo modifica; los nombres
+        consultados se devuelven para que _apply_sync_snapshot los guarde desde el hilo de Tk.
+        
+        Devuelve (movs, nuevos): tuplas (codigo, producto[:22], conteo_fisico, diferencia,
+        fecha "dd/mm HH:MM", nombre_equipo) y el dict {id: nombre_equipo} recién consultado.
+        """
+        nombres = dict(self._equipo_nombres)
+        ids = {m[5] for m in movs if m[5] is not None}
+        faltan = tuple(ids - nombres.keys())
+        nuevos = {}
+        if faltan:
+            rows, _ = self.db.execute_query_rows(
+                f"SELECT id, nombre_equipo FROM equipos WHERE id IN ({','.join(['%s'] * len(faltan))})",
+                faltan
+            )
+            nuevos = dict(rows)
+            nombres.update(nuevos)
+        
+        # Producto recortado y fecha formateada aquí para que el pintado solo compare y configure textos
+        return [(m[0], str(m[1])[:22], m[2], m[3], self._fmt_fecha_corta(m[4]), nombres.get(m[5]))
+                for m in movs], nuevos
+    
+    @staticmethod
+    def _fmt_fecha_corta(fecha):
+        """Fecha de conteo como "dd/mm HH:MM" sin pasar por strftime"""
+        if not fecha:
+            return "--/-- --:--"
+        return f"{fecha.day:02d}/{fecha.month:02d} {fecha.hour:02d}:{fecha.minute:02d}"
+    
+    def _apply_sync_snapshot(self, snapshot):
+        """Aplica en un solo tick de Tk los resultados de un ciclo de sincronización"""
+        for clave, label in (('avance', self.kpi_avance), ('pendientes', self.kpi_pendientes),
+                             ('exactitud', self.kpi_exactitud), ('faltantes', self.kpi_faltantes),
+                             ('sobrantes', self.kpi_sobrantes), ('total', self.kpi_total)):
+            # Solo reconfigurar lo que cambió: CTkLabel redibuja en cada configure
+            if snapshot[clave] is not None and label.cget("text") != snapshot[clave]:
+                label.configure(text=snapshot[clave])
+        
+        # Siempre actualizar cache de datos
+        self._equipo_nombres.update(snapshot['equipos_nuevos'])
+        self.data_pendientes = snapshot['data_pend']
+        self.data_diferencias = snapshot['data_dif']
+        
+        if snapshot['refrescar_tabs']:
+            self._update_tabs_ui()
+            self._update_historial_ui(snapshot['movs'])
+        
+        self.lbl_sync.configure(text=f"Sincronizado {snapshot['sync_ts']}")
+    
     # ========================================================================
     # FILTROS Y BÚSQUEDA
     # ========================================================================
@@ -2154,239 +3399,205 @@ class InventarioApp(ctk.CTk):
             return
         
         try:
-            lins = self.db.execute_query(
-                "SELECT DISTINCT linea FROM items_corte WHERE sesion_id=%s ORDER BY linea",
-                (self.sesion_id,), fetch=True
-            )
-            VentanaMultiSelect(self, [l['linea'] for l in lins], self._apply_filter)
+            lineas = self._lineas_cache.get(self.sesion_id)
+            if lineas is None:
+                # GROUP BY sobre (sesion_id, linea) se resuelve recorriendo solo el índice
+                rows, _ = self.db.execute_query_rows(
+                    "SELECT linea FROM items_corte WHERE sesion_id=%s GROUP BY linea ORDER BY linea",
+                    (self.sesion_id,)
+                )
+                lineas = [r[0] for r in rows]
+                self._lineas_cache[self.sesion_id] = lineas
+            VentanaMultiSelect(self, lineas, self._apply_filter)
         except Exception as e:
-            logger.error(f"Error filtro: {e}")
+            logger.error("Error filtro: %s", e)
+    
+    def _set_filtro_lineas(self, lineas):
+        """Guarda el filtro de líneas y precalcula su fragmento SQL para la sincronización"""
+        self.filtro_lineas = lineas
+        if lineas:
+            self._filtro_sql = (f" AND linea IN ({','.join(['%s'] * len(lineas))})", tuple(lineas))
+        else:
+            self._filtro_sql = ("", ())
     
     def _apply_filter(self, sel):
-        self.filtro_lineas = sel
+        self._set_filtro_lineas(sel)
         self.lbl_filtro.configure(
             text=f"{len(sel)} líneas" if sel else "(Todas)"
         )
         self._refresh_all()
         self._log(f"Filtro aplicado: {len(sel)} líneas")
     
+    def _debounce(self, clave, fn, ms=150):
+        """Ejecuta fn ms después de la última tecla; cada pulsación reinicia la espera"""
+        pendiente = self._busqueda_after.get(clave)
+        if pendiente:
+            self.after_cancel(pendiente)
+        self._busqueda_after[clave] = self.after(ms, fn)
+    
     def _filtrar_busqueda(self):
-        """Filtra búsqueda general en maestro"""
+        """Filtra búsqueda general en maestro (consulta en background)"""
         if not self.sesion_id:
             return
         
         txt = self.en_busqueda.get().upper()
         
-        for w in self.scroll_busqueda.winfo_children():
-            w.destroy()
+        self.tv_busqueda.delete(*self.tv_busqueda.get_children())
+        # Invalida resultados de búsquedas anteriores aún en curso
+        self._busqueda_seq += 1
         
         if len(txt) < 2:
             return
         
-        try:
-            query = """SELECT codigo, producto, conteo_fisico, stock_sistema 
-                       FROM items_corte 
-                       WHERE sesion_id=%s AND (codigo LIKE %s OR producto LIKE %s)
-                       LIMIT 30"""
-            
-            items = self.db.execute_query(
-                query, (self.sesion_id, f"%{txt}%", f"%{txt}%"), fetch=True
+        seq = self._busqueda_seq
+        sesion_id = self.sesion_id
+        
+        def buscar_background():
+            try:
+                items = self._buscar_items(sesion_id, txt)
+                self._publicar(self._on_busqueda_lista, seq, items)
+            except Exception as e:
+                logger.error("Error búsqueda: %s", e)
+        
+        threading.Thread(target=buscar_background, daemon=True).start()
+    
+    def _buscar_items(self, sesion_id, txt, limite=30):
+        """Busca por código o producto; primero prefijos de código, luego coincidencias parciales.
+        
+        La collation utf8mb4_unicode_ci ya compara sin distinguir mayúsculas, así que no se usa
+        UPPER() (impediría usar índices). 'codigo LIKE txt%' es un rango sobre uk_sesion_codigo;
+        solo si no alcanza el límite se recorre la sesión con '%txt%'.
+        """
+        patron = self._escapar_like(txt)
+        items = self.db.execute_query_preparada(
+            """SELECT codigo, producto, conteo_fisico, stock_sistema 
+               FROM items_corte 
+               WHERE sesion_id=%s AND codigo LIKE %s
+               ORDER BY codigo LIMIT %s""",
+            (sesion_id, f"{patron}%", limite)
+        )
+        
+        if len(items) < limite:
+            resto = self.db.execute_query_preparada(
+                """SELECT codigo, producto, conteo_fisico, stock_sistema 
+                   FROM items_corte 
+                   WHERE sesion_id=%s AND codigo NOT LIKE %s
+                   AND (codigo LIKE %s OR producto LIKE %s)
+                   LIMIT %s""",
+                (sesion_id, f"{patron}%", f"%{patron}%", f"%{patron}%", limite - len(items))
             )
+            items += resto
+        return items
+    
+    @staticmethod
+    def _escapar_like(txt):
+        """Escapa los comodines de LIKE para buscar el texto tal cual"""
+        return txt.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    
+    def _on_busqueda_lista(self, seq, items):
+        """Vuelca los resultados de búsqueda si siguen siendo los de la última tecla"""
+        if seq != self._busqueda_seq:
+            return
+        
+        estados = self.ESTADOS_BUSQUEDA
+        for codigo, producto, conteo, stock in items:
+            contado = float(conteo) if conteo else 0.0
+            stock = float(stock) if stock else 0.0
             
-            for item in items:
-                contado = float(item['conteo_fisico']) if item['conteo_fisico'] else 0.0
-                stock = float(item['stock_sistema']) if item['stock_sistema'] else 0.0
-                
-                # Determinar estado: PENDIENTE, CONTADO o CUADRADO
-                if contado == 0:
-                    status = "PENDIENTE"
-                    color = "#2B2B2B"  # Gris oscuro más tenue
-                elif contado == stock:
-                    status = f"CUADRADO: {contado:.0f}"
-                    color = "#1F4D2E"  # Verde oscuro más tenue
-                else:
-                    dif = contado - stock
-                    status = f"CONTADO: {contado:.0f} | Dif: {dif:+.0f}"
-                    color = "#4D3D1F"  # Naranja oscuro más tenue
-                
-                self._mk_row_clickable_with_status(
-                    self.scroll_busqueda, 
-                    item['codigo'], 
-                    item['producto'],
-                    status,
-                    color,
-                    stock
-                )
-        except Exception as e:
-            logger.error(f"Error búsqueda: {e}")
+            # Determinar estado: PENDIENTE, CUADRADO o CONTADO
+            fmt, tag = estados[0 if contado == 0 else 1 if contado == stock else 2]
+            status = fmt.format(c=contado, d=contado - stock)
+            
+            self.tv_busqueda.insert(
+                "", "end", tags=(tag,),
+                values=(codigo, str(producto)[:35], status, f"{stock:.0f}")
+            )
     
     def _update_tabs_ui(self):
         """Actualiza UI de tabs pendientes y diferencias (operación pesada)"""
         try:
-            self._filtrar_precalc("", self.scroll_pendientes, self.data_pendientes)
-            self._filtrar_precalc("", self.scroll_diferencias, self.data_diferencias)
+            for clave, tabla, data in (
+                ('pendientes', self.tv_pendientes, self.data_pendientes),
+                ('diferencias', self.tv_diferencias, self.data_diferencias),
+            ):
+                # Pestaña aún sin construir o sin cambios (bodega sin actividad)
+                if tabla is None or self._ultimo_render.get(clave) == data:
+                    continue
+                self._ultimo_render[clave] = data
+                # Respeta el filtro escrito: con texto vuelve a consultar, sin texto vuelca el ciclo
+                self._filtrar_tab(clave)
         except Exception as e:
-            logger.error(f"Error actualizando tabs: {e}")
+            logger.error("Error actualizando tabs: %s", e)
     
-    def _filtrar_precalc(self, txt, frame, data):
-        """Filtra lista precalculada"""
-        for w in frame.winfo_children():
-            w.destroy()
-        
-        txt = txt.upper()
-        count = 0
+    def _filtrar_tab(self, clave):
+        """Filtra una pestaña de lista; con texto la consulta se resuelve en el servidor"""
+        if clave == 'pendientes':
+            entrada, tabla, data = self.en_buscar_pend, self.tv_pendientes, self.data_pendientes
+        else:
+            entrada, tabla, data = self.en_buscar_dif, self.tv_diferencias, self.data_diferencias
         
-        for item in data:
-            if count > 50:
-                break
-            
-            cod = str(item[0])
-            nom = str(item[1])
-            
-            if txt in cod or txt in nom.upper():
-                # Extraer stock y diferencia si existen
-                stock = item[2] if len(item) > 2 else None
-                diferencia = item[3] if len(item) > 3 else None
-                
-                # Si tiene diferencia (viene de tab diferencias)
-                if diferencia is not None:
-                    self._mk_row_clickable(frame, cod, nom, stock, diferencia)
-                # Si solo tiene stock (viene de tab pendientes)
-                elif stock is not None:
-                    self._mk_row_clickable(frame, cod, nom, stock, None)
-                # Sin datos adicionales
-                else:
-                    self._mk_row_clickable(frame, cod, nom, None, None)
-                count += 1
-    
-    def _mk_row_clickable(self, parent, codigo, texto, stock=None, diferencia=None):
-        """Crea fila clickeable - estilo tabla con stock y diferencia opcionales"""
-        frame = ctk.CTkFrame(parent, fg_color="#2B2B2B", height=32)
-        frame.pack(fill="x", pady=1, padx=0)
-        frame.pack_propagate(False)
-
-        # Columna Código
-        cod_frame = ctk.CTkFrame(frame, fg_color="transparent", width=100)
-        cod_frame.pack(side="left", fill="y", padx=(5, 0))
-        cod_frame.pack_propagate(False)
+        # Invalida resultados de filtros anteriores aún en curso
+        self._filtro_tab_seq[clave] += 1
+        txt = entrada.get().strip()
         
-        ctk.CTkButton(
-            cod_frame,
-            text=codigo,
-            anchor="w",
-            fg_color="transparent",
-            hover_color="#444",
-            font=("Arial", 9),
-            command=lambda: self._cargar_desde_lista(codigo)
-        ).pack(fill="both", expand=True)
-
-        # Columna Producto
-        prod_frame = ctk.CTkFrame(frame, fg_color="transparent")
-        prod_frame.pack(side="left", fill="both", expand=True, padx=5)
+        if not txt or not self.sesion_id:
+            self._volcar_lista(tabla, data)
+            return
         
-        ctk.CTkButton(
-            prod_frame,
-            text=texto[:45],
-            anchor="w",
-            fg_color="transparent",
-            hover_color="#444",
-            font=("Arial", 9),
-            command=lambda: self._cargar_desde_lista(codigo)
-        ).pack(fill="both", expand=True)
-
-        # Columna Stock (si se proporciona)
-        if stock is not None:
-            stock_frame = ctk.CTkFrame(frame, fg_color="transparent", width=80)
-            stock_frame.pack(side="right", fill="y", padx=(0, 5))
-            stock_frame.pack_propagate(False)
-            
-            ctk.CTkLabel(
-                stock_frame,
-                text=f"{stock:.0f}",
-                font=("Arial", 9),
-                text_color="#FFFFFF"
-            ).pack(expand=True)
-        
-        # Columna Diferencia (si se proporciona)
-        if diferencia is not None:
-            dif_frame = ctk.CTkFrame(frame, fg_color="transparent", width=100)
-            dif_frame.pack(side="right", fill="y", padx=(0, 5))
-            dif_frame.pack_propagate(False)
-            
-            dif_color = Colors.DANGER if diferencia < 0 else Colors.WARNING
-            ctk.CTkLabel(
-                dif_frame,
-                text=f"{diferencia:+.0f}",
-                font=("Arial", 9, "bold"),
-                text_color=dif_color
-            ).pack(expand=True)
-
-    def _mk_row_clickable_with_status(self, parent, codigo, texto, status, color, stock=0):
-        """Crea fila clickeable con estado de conteo - estilo tabla"""
-        frame = ctk.CTkFrame(parent, fg_color=color, height=32)
-        frame.pack(fill="x", pady=1, padx=0)
-        frame.pack_propagate(False)
-
-        # Columna Código
-        cod_frame = ctk.CTkFrame(frame, fg_color="transparent", width=100)
-        cod_frame.pack(side="left", fill="y", padx=(5, 0))
-        cod_frame.pack_propagate(False)
+        seq = self._filtro_tab_seq[clave]
+        sesion_id = self.sesion_id
         
-        ctk.CTkButton(
-            cod_frame,
-            text=codigo,
-            anchor="w",
-            fg_color="transparent",
-            hover_color="#555555",
-            font=("Arial", 9),
-            command=lambda: self._cargar_desde_lista(codigo)
-        ).pack(fill="both", expand=True)
-
-        # Columna Producto
-        prod_frame = ctk.CTkFrame(frame, fg_color="transparent")
-        prod_frame.pack(side="left", fill="both", expand=True, padx=5)
+        def filtrar_background():
+            try:
+                filas = self._buscar_lista(sesion_id, clave, txt)
+                self._publicar(self._on_lista_filtrada, clave, seq, tabla, filas)
+            except Exception as e:
+                logger.error("Error filtrando %s: %s", clave, e)
         
-        ctk.CTkButton(
-            prod_frame,
-            text=texto[:35],
-            anchor="w",
-            fg_color="transparent",
-            hover_color="#555555",
-            font=("Arial", 9),
-            command=lambda: self._cargar_desde_lista(codigo)
-        ).pack(fill="both", expand=True)
-
-        # Columna Stock
-        stock_frame = ctk.CTkFrame(frame, fg_color="transparent", width=80)
-        stock_frame.pack(side="right", fill="y", padx=(0, 5))
-        stock_frame.pack_propagate(False)
-        
-        ctk.CTkLabel(
-            stock_frame,
-            text=f"{stock:.0f}",
-            font=("Arial", 9),
-            text_color="#FFFFFF"
-        ).pack(expand=True)
-
-        # Columna Estado
-        if "CUADRADO" in status:
-            status_color = "#4CAF50"  # Verde brillante
-        elif "CONTADO" in status:
-            status_color = "#FFA726"  # Naranja brillante
-        else:
-            status_color = "#FFD54F"  # Amarillo brillante para pendiente
-        
-        status_frame = ctk.CTkFrame(frame, fg_color="transparent", width=180)
-        status_frame.pack(side="right", fill="y", padx=(0, 5))
-        status_frame.pack_propagate(False)
-        
-        ctk.CTkLabel(
-            status_frame,
-            text=status,
-            font=("Arial", 9, "bold"),
-            text_color=status_color
-        ).pack(expand=True)
-
+        threading.Thread(target=filtrar_background, daemon=True).start()
+    
+    def _buscar_lista(self, sesion_id, clave, txt):
+        """Filas de la pestaña que contienen txt en código o producto (mismo criterio y filtro de líneas)"""
+        columnas, predicado = self.SQL_LISTA[clave]
+        filtro, p_lineas = self._filtro_sql
+        patron = f"%{self._escapar_like(txt)}%"
+        filas = self.db.execute_query_preparada(
+            f"""SELECT {columnas} FROM items_corte
+               WHERE sesion_id=%s AND {predicado}{filtro}
+               AND (codigo LIKE %s OR producto LIKE %s)
+               LIMIT %s""",
+            (sesion_id, *p_lineas, patron, patron, self.LIMITE_LISTA)
+        )
+        return [self._fila_lista(*fila) for fila in filas]
+    
+    def _on_lista_filtrada(self, clave, seq, tabla, filas):
+        """Vuelca el filtro si sigue siendo el de la última tecla"""
+        if seq == self._filtro_tab_seq[clave]:
+            self._volcar_lista(tabla, filas)
+    
+    @staticmethod
+    def _fila_lista(codigo, producto, diferencia, stock):
+        """Fila lista para volcar: (codigo, producto, stock) o (codigo, producto, diferencia, stock)"""
+        stock = float(stock) if stock else 0
+        if diferencia is None:
+            return (codigo, str(producto)[:45], stock)
+        return (codigo, str(producto)[:45], diferencia, stock)
+    
+    @staticmethod
+    def _volcar_lista(tabla, data):
+        """Reemplaza el contenido de la tabla por las filas dadas"""
+        tabla.delete(*tabla.get_children())
+        for item in data:
+            cod = str(item[0])
+            # Si tiene diferencia (viene de tab diferencias)
+            if len(item) > 3:
+                diferencia = item[2]
+                tabla.insert("", "end",
+                             values=(cod, item[1], f"{diferencia:+.0f}", f"{item[3]:.0f}"),
+                             tags=("faltante" if diferencia < 0 else "sobrante",))
+            else:
+                tabla.insert("", "end", values=(cod, item[1], f"{item[2]:.0f}"))
+    
     def _cargar_desde_lista(self, codigo):
         """Carga código desde lista"""
         self.en_codigo.delete(0, 'end')
@@ -2410,10 +3621,7 @@ class InventarioApp(ctk.CTk):
         ok, res = InputValidator.validate_codigo(cod)
         
         if not ok:
-            try:
-                winsound.Beep(500, 300)  # Beep más grave para error
-            except Exception:
-                pass
+            Sonidos.play('error')  # Beep más grave para error
             messagebox.showwarning("!", res)
             return
         
@@ -2426,15 +3634,9 @@ class InventarioApp(ctk.CTk):
         self._log(f"Buscando: {cod}")
         
         try:
-            prod = self.db.execute_query(
-                """SELECT i.*, e.nombre_equipo FROM items_corte i 
-                   LEFT JOIN equipos e ON i.ultimo_equipo_id=e.id 
-                   WHERE i.sesion_id=%s AND i.codigo=%s""",
-                (self.sesion_id, cod), fetch=True
-            )
+            p = self.db.get_item(self.sesion_id, cod)
             
-            if prod:
-                p = prod[0]
+            if p:
                 self.producto_actual = {
                     "codigo": cod,
                     "nombre": p['producto'],
@@ -2485,10 +3687,7 @@ class InventarioApp(ctk.CTk):
                 
             else:
                 # Producto no existe
-                try:
-                    winsound.Beep(700, 400)  # Beep medio para advertencia
-                except Exception:
-                    pass
+                Sonidos.play('aviso')  # Beep medio para advertencia
                 
                 self.lbl_op_status.configure(
                     text=f"ADVERTENCIA - Codigo '{cod}' NO ENCONTRADO", 
@@ -2505,7 +3704,7 @@ class InventarioApp(ctk.CTk):
                     )
                     
         except Exception as e:
-            logger.error(f"Error búsqueda: {e}")
+            logger.error("Error búsqueda: %s", e)
             messagebox.showerror("Error", f"Error: {e}")
     
     def _mostrar_conflicto_equipo(self, producto):
@@ -2564,7 +3763,8 @@ class InventarioApp(ctk.CTk):
             try:
                 self.db.execute_query(
                     """INSERT INTO items_corte (sesion_id, codigo, producto, linea, stock_sistema) 
-                       VALUES (%s, %s, %s, %s, 0)""",
+                       VALUES (%s, %s, %s, %s, 0)
+                       ON DUPLICATE KEY UPDATE id=id""",
                     (self.sesion_id, cod, nom, lin or "SIN LINEA")
                 )
                 
@@ -2582,6 +3782,7 @@ class InventarioApp(ctk.CTk):
                 self.en_cantidad.focus()
                 self.en_cantidad.select_range(0, 'end')
                 
+                self._lineas_cache.pop(self.sesion_id, None)
                 self._log(f"Producto EXTRA agregado: {cod}")
                 close()
                 
@@ -2610,21 +3811,23 @@ class InventarioApp(ctk.CTk):
         
         try:
             # Verificar si ya existe conteo
-            existe = self.db.execute_query(
+            existe = self.db.execute_query_preparada(
                 """SELECT ic.conteo_fisico, ic.ultimo_equipo_id, e.nombre_equipo, ic.fecha_conteo
                    FROM items_corte ic
                    LEFT JOIN equipos e ON ic.ultimo_equipo_id = e.id
                    WHERE ic.sesion_id=%s AND ic.codigo=%s""",
-                (self.sesion_id, cod), fetch=True
+                (self.sesion_id, cod)
             )
             
-            if existe and existe[0]['conteo_fisico'] > 0:
-                self._mostrar_dialogo_duplicado(cod, existe[0], cant)
+            if existe and existe[0][0] > 0:
+                item = dict(zip(('conteo_fisico', 'ultimo_equipo_id', 'nombre_equipo', 'fecha_conteo'),
+                                existe[0]))
+                self._mostrar_dialogo_duplicado(cod, item, cant)
             else:
                 self._guardar_conteo(cod, cant, "NUEVO", 0)
                 
         except Exception as e:
-            logger.error(f"Error pre-save: {e}")
+            logger.error("Error pre-save: %s", e)
     
     def _mostrar_dialogo_duplicado(self, cod, item_data, cant_nueva):
         """Muestra diálogo para duplicados"""
@@ -2722,48 +3925,36 @@ class InventarioApp(ctk.CTk):
         ).pack(fill="x", padx=5)
     
     def _guardar_conteo(self, cod, cant, tipo, cant_ant):
-        """Guarda conteo en BD (ejecuta en background thread)"""
+        """Encola el guardado del conteo en el escritor único de BD"""
         nov = self.en_novedad.get().strip()
         if self.producto_actual["es_nuevo"]:
             nov = f"(NUEVO) {nov}"
         
         nombre_producto = self.producto_actual.get("nombre", cod)[:40]
         
-        # Ejecutar guardado en background para no bloquear UI
+        # Datos capturados ahora: el formulario y la sesión pueden cambiar antes de que se ejecute
+        sesion_id, equipo_id = self.sesion_id, self.equipo_id
+        
         def guardar_background():
             try:
-                # Actualizar item
-                self.db.execute_query(
-                    """UPDATE items_corte 
-                       SET conteo_fisico=%s, novedad=%s, fecha_conteo=NOW(), ultimo_equipo_id=%s 
-                       WHERE sesion_id=%s AND codigo=%s""",
-                    (cant, nov, self.equipo_id, self.sesion_id, cod)
-                )
-                
-                # Registrar historial
-                self.db.execute_query(
-                    """INSERT INTO historial_movimientos 
-                       (sesion_id, item_codigo, equipo_id, tipo_accion, cantidad_anterior, cantidad_resultante, fecha_movimiento) 
-                       VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
-                    (self.sesion_id, cod, self.equipo_id, tipo, cant_ant, cant)
-                )
+                # Item + historial en una sola transacción
+                self.db.guardar_conteo(sesion_id, cod, cant, nov, equipo_id, tipo, cant_ant)
                 
                 # Actualizar UI desde main thread
-                self.after(0, lambda: self._on_guardado_exitoso(nombre_producto, cant, tipo, cod))
+                self._publicar(lambda: self._on_guardado_exitoso(nombre_producto, cant, tipo, cod))
                 
             except Exception as e:
-                logger.error(f"Error guardando: {e}")
-                self.after(0, lambda: messagebox.showerror("Error", f"Error: {e}"))
+                logger.error("Error guardando: %s", e)
+                # 'e' se borra al salir del except: pasar el texto, no la variable
+                if not self._cerrando.is_set():
+                    self._publicar(messagebox.showerror, "Error", f"Error: {e}")
         
-        threading.Thread(target=guardar_background, daemon=True).start()
+        self._ultimo_guardado = self._guardado_worker.submit(guardar_background)
     
     def _on_guardado_exitoso(self, nombre_producto, cant, tipo, cod):
         """Callback cuando el guardado es exitoso (ejecuta en main thread)"""
         # BEEP de éxito
-        try:
-            winsound.Beep(1000, 200)
-        except Exception:
-            pass
+        Sonidos.play('ok')
         
         # Mensaje de éxito visual destacado
         mensaje_exito = f"OK - ITEM '{nombre_producto}' INVENTARIADO: {cant} unidades ({tipo})"
@@ -2800,66 +3991,98 @@ class InventarioApp(ctk.CTk):
     # ========================================================================
     
     def _refresh_all(self):
-        """Refresca todos los datos - forzar actualización completa"""
+        """Refresca todos los datos - las llamadas seguidas se agrupan en un solo ciclo"""
         self.sync_counter = 2  # Forzar actualización en el siguiente ciclo
-        self._sync_update()  # Una sola llamada para todo
+        # Los nombres de equipo pueden haber cambiado (edición, restauración de backup)
+        self._equipo_nombres.clear()
+        if self._refresh_after_id is None:
+            self._refresh_after_id = self.after(50, self._do_refresh)
     
-    def _update_kpis(self):
-        """Actualiza KPIs - usa _sync_update para no duplicar código"""
-        self._sync_update()
-    
-    def _load_historial(self):
-        """Carga historial - usa _sync_update para no duplicar código"""
-        self._sync_update()
+    def _do_refresh(self):
+        """Ejecuta el refresco agrupado; si hay un ciclo en curso, reintenta al terminar"""
+        if self.sync_in_progress:
+            self._refresh_after_id = self.after(100, self._do_refresh)
+            return
+        
+        self._refresh_after_id = None
+        self._sync_update()  # Una sola llamada para todo
     
     def _update_historial_ui(self, movs):
-        """Actualiza UI del historial (se ejecuta en main thread)"""
-        for w in self.scroll_historial.winfo_children():
-            w.destroy()
+        """Actualiza UI del historial (se ejecuta en main thread) reutilizando filas"""
+        if self._ultimo_render.get('historial') == movs:
+            return
+        self._ultimo_render['historial'] = movs
         
-        for m in movs:
-            frame = ctk.CTkFrame(self.scroll_historial, fg_color="#2B2B2B")
-            frame.pack(fill="x", pady=2, padx=3)
-            
-            # Producto
-            ctk.CTkLabel(frame, text=m['producto'][:22], anchor="w",
-                       font=("Arial", 10, "bold")).pack(fill="x", padx=5, pady=(5, 2))
-            
-            # Fila 1: Cantidad y Diferencia
-            info_frame = ctk.CTkFrame(frame, fg_color="transparent")
-            info_frame.pack(fill="x", padx=5, pady=1)
-            
-            ctk.CTkLabel(info_frame, text=f"Cant: {m['conteo_fisico']}", 
-                       font=("Arial", 9, "bold")).pack(side="left")
-            
-            dif = float(m['diferencia'] or 0)
-            col = Colors.DANGER if dif != 0 else Colors.SUCCESS
-            ctk.CTkLabel(info_frame, text=f"Dif: {dif:+.2f}", 
-                       text_color=col, font=("Arial", 9, "bold")).pack(side="right")
-            
-            # Fila 2: Equipo y Fecha/Hora
-            equipo_fecha_frame = ctk.CTkFrame(frame, fg_color="transparent")
-            equipo_fecha_frame.pack(fill="x", padx=5, pady=(1, 5))
-            
-            equipo_text = f"Equipo {m['nombre_equipo']}" if m.get('nombre_equipo') else "Equipo N/A"
-            ctk.CTkLabel(equipo_fecha_frame, text=equipo_text, anchor="w",
-                       font=("Arial", 8), text_color="#FFD700").pack(side="left")
-            
-            if m.get('fecha_conteo'):
-                fecha_str = m['fecha_conteo'].strftime("%d/%m %H:%M")
+        # Ocultar filas sobrantes en lugar de destruirlas: se reutilizan en el próximo ciclo
+        for fila in self._filas_historial[len(movs):]:
+            fila[0].pack_forget()
+        
+        for i, m in enumerate(movs):
+            if i < len(self._filas_historial):
+                fila = self._filas_historial[i]
             else:
-                fecha_str = "--/-- --:--"
+                fila = self._mk_fila_historial()
+                self._filas_historial.append(fila)
             
-            ctk.CTkLabel(equipo_fecha_frame, text=fecha_str, anchor="e",
-                       font=("Arial", 8), text_color="gray").pack(side="right", padx=(0, 8))
+            self._pintar_fila_historial(fila, m)
+            # Las filas visibles ya están en orden; solo se empaquetan las que estaban ocultas
+            if not fila[0].winfo_manager():
+                fila[0].pack(fill="x", pady=2, padx=3)
     
-    def _load_pendientes(self):
-        """Carga pendientes - usa _sync_update para no duplicar código"""
-        self._sync_update()
+    def _mk_fila_historial(self):
+        """Crea los widgets (vacíos) de una fila del historial"""
+        frame = ctk.CTkFrame(self.scroll_historial, fg_color="#2B2B2B")
+        
+        # Producto
+        lbl_prod = ctk.CTkLabel(frame, text="", anchor="w", font=("Arial", 10, "bold"))
+        lbl_prod.pack(fill="x", padx=5, pady=(5, 2))
+        
+        # Fila 1: Cantidad y Diferencia
+        info_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        info_frame.pack(fill="x", padx=5, pady=1)
+        
+        lbl_cant = ctk.CTkLabel(info_frame, text="", font=("Arial", 9, "bold"))
+        lbl_cant.pack(side="left")
+        
+        lbl_dif = ctk.CTkLabel(info_frame, text="", font=("Arial", 9, "bold"))
+        lbl_dif.pack(side="right")
+        
+        # Fila 2: Equipo y Fecha/Hora
+        equipo_fecha_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        equipo_fecha_frame.pack(fill="x", padx=5, pady=(1, 5))
+        
+        lbl_equipo = ctk.CTkLabel(equipo_fecha_frame, text="", anchor="w",
+                                  font=("Arial", 8), text_color="#FFD700")
+        lbl_equipo.pack(side="left")
+        
+        lbl_fecha = ctk.CTkLabel(equipo_fecha_frame, text="", anchor="e",
+                                 font=("Arial", 8), text_color="gray")
+        lbl_fecha.pack(side="right", padx=(0, 8))
+        
+        return frame, lbl_prod, lbl_cant, lbl_dif, lbl_equipo, lbl_fecha
     
-    def _load_diferencias(self):
-        """Carga diferencias - usa _sync_update para no duplicar código"""
-        self._sync_update()
+    @staticmethod
+    def _pintar_fila_historial(fila, m):
+        """Escribe un movimiento en una fila del historial, tocando solo los textos que cambian"""
+        _, lbl_prod, lbl_cant, lbl_dif, lbl_equipo, lbl_fecha = fila
+        _, producto, conteo, diferencia, fecha_str, nombre_equipo = m
+        
+        dif = float(diferencia or 0)
+        equipo_text = f"Equipo {nombre_equipo}" if nombre_equipo else "Equipo N/A"
+        
+        textos = (
+            (lbl_prod, producto),
+            (lbl_cant, f"Cant: {conteo}"),
+            (lbl_equipo, equipo_text),
+            (lbl_fecha, fecha_str),
+        )
+        for label, texto in textos:
+            if label.cget("text") != texto:
+                label.configure(text=texto)
+        
+        if lbl_dif.cget("text") != f"Dif: {dif:+.2f}":
+            lbl_dif.configure(text=f"Dif: {dif:+.2f}",
+                              text_color=Colors.DANGER if dif != 0 else Colors.SUCCESS)
     
     # ========================================================================
     # UTILIDADES UI
@@ -2877,7 +4100,7 @@ class InventarioApp(ctk.CTk):
     def _log(self, msg):
         """Agrega mensaje a consola"""
         try:
-            ts = datetime.now().strftime("%H:%M:%S")
+            ts = Utils.hora_actual()
             self.console_box.configure(state="normal")
             self.console_box.insert("end", f"[{ts}] {msg}\n")
             self.console_box.see("end")
@@ -2895,83 +4118,174 @@ class InventarioApp(ctk.CTk):
             messagebox.showwarning("!", "Seleccione un corte")
             return
         
+        if self._exportando:
+            return
+        
+        self._exportando = True
+        fn = f"REPORTE_{self.sesion_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        self._log(f"Exportando {fn}...")
+        threading.Thread(target=self._exportar_background, args=(fn, self.sesion_id), daemon=True).start()
+    
+    def _exportar_background(self, fn, sesion_id):
+        """Escribe el reporte en background; avanza hoja por hoja en la consola"""
         try:
-            fn = f"REPORTE_{self.sesion_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+            import xlsxwriter
+            params = (sesion_id,)
             
-            with self.db.get_connection() as conn:
-                # Hoja 1: Conteo completo con equipo
-                df_conteo = pd.read_sql(
-                    f"""SELECT i.*, e.nombre_equipo as equipo_numero, e.integrantes as equipo_integrantes 
-                        FROM items_corte i 
-                        LEFT JOIN equipos e ON i.ultimo_equipo_id=e.id 
-                        WHERE i.sesion_id={self.sesion_id}""",
-                    conn
-                )
-                
-                # Hoja 2: Solo diferencias con equipo
-                df_dif = pd.read_sql(
-                    f"""SELECT i.*, e.nombre_equipo as equipo_numero, e.integrantes as equipo_integrantes 
-                        FROM items_corte i 
-                        LEFT JOIN equipos e ON i.ultimo_equipo_id=e.id 
-                        WHERE i.sesion_id={self.sesion_id} AND i.diferencia!=0 AND i.conteo_fisico>0""",
-                    conn
-                )
-                
-                # Hoja 3: Pendientes
-                df_pend = pd.read_sql(
-                    f"SELECT * FROM items_corte WHERE sesion_id={self.sesion_id} AND conteo_fisico=0",
-                    conn
-                )
-                
-                # Hoja 4: Historial con equipo
-                df_hist = pd.read_sql(
-                    f"""SELECT h.*, e.nombre_equipo as equipo_numero, e.integrantes as equipo_integrantes 
-                        FROM historial_movimientos h 
-                        LEFT JOIN equipos e ON h.equipo_id=e.id 
-                        WHERE h.sesion_id={self.sesion_id}""",
-                    conn
-                )
-                
-                with pd.ExcelWriter(fn, engine='openpyxl') as writer:
-                    df_conteo.to_excel(writer, sheet_name="CONTEO_COMPLETO", index=False)
-                    df_dif.to_excel(writer, sheet_name="DIFERENCIAS", index=False)
-                    df_pend.to_excel(writer, sheet_name="PENDIENTES", index=False)
-                    df_hist.to_excel(writer, sheet_name="HISTORIAL", index=False)
+            # Corte vacío: no vale la pena leer equipos ni crear el libro
+            if not self.db.execute_query_preparada(
+                    "SELECT 1 FROM items_corte WHERE sesion_id=%s LIMIT 1", params):
+                self._publicar(self._on_exportado, fn, None, True)
+                return
+            
+            # equipos es una tabla chica: se lee una vez y se cruza en Python en lugar de un JOIN
+            # por consulta. La última columna de cada consulta es el id del equipo.
+            rows, _ = self.db.execute_query_rows("SELECT id, nombre_equipo, integrantes FROM equipos")
+            equipos = {eq_id: (nombre, integrantes) for eq_id, nombre, integrantes in rows}
+            
+            # Hojas 1-3: conteo completo con equipo; diferencias y pendientes son subconjuntos
+            # de la misma lectura, así que items_corte se recorre una sola vez
+            q_conteo = """SELECT codigo, producto, linea, stock_sistema, conteo_fisico,
+                                 diferencia, novedad, fecha_conteo, ultimo_equipo_id
+                          FROM items_corte 
+                          WHERE sesion_id=%s"""
+            # Hoja 4: Historial con equipo
+            q_historial = """SELECT item_codigo, tipo_accion, cantidad_anterior,
+                                    cantidad_resultante, fecha_movimiento, equipo_id
+                             FROM historial_movimientos 
+                             WHERE sesion_id=%s"""
+            
+            # constant_memory: cada fila se escribe a disco al pasar a la siguiente
+            wb = xlsxwriter.Workbook(fn, {
+                'constant_memory': True,
+                'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+            })
+            try:
+                fmt_header = wb.add_format({'bold': True, 'border': 1, 'align': 'center'})
                 
+                self._publicar(self._log, "Exportando hojas CONTEO_COMPLETO, DIFERENCIAS y PENDIENTES...")
+                ws_dif, n_cols, n_dif = self._escribir_conteo_excel(
+                    wb, fmt_header, self._lotes_export(q_conteo, params, equipos))
                 # Pintar diferencias
-                self._pintar_diferencias_excel(fn)
+                self._pintar_diferencias_excel(wb, ws_dif, n_cols, n_dif)
+                
+                self._publicar(self._log, "Exportando hoja HISTORIAL...")
+                self._escribir_hoja_excel(wb.add_worksheet("HISTORIAL"), fmt_header,
+                                          self._lotes_export(q_historial, params, equipos))
+            finally:
+                wb.close()
             
-            messagebox.showinfo("✅", f"Exportado:\n{fn}")
-            self._log(f"Exportado: {fn}")
+            self._publicar(self._on_exportado, fn, None)
             
         except Exception as e:
-            logger.error(f"Error export: {e}")
-            messagebox.showerror("Error", f"Error:\n{e}")
+            logger.error("Error export: %s", e)
+            self._publicar(self._on_exportado, fn, str(e))
     
-    def _pintar_diferencias_excel(self, filename):
-        """Pinta celdas con diferencias"""
-        try:
-            wb = load_workbook(filename)
+    def _on_exportado(self, fn, error, vacio=False):
+        """Resultado de la exportación (main thread).
+        
+        Primero se escribe en consola y el aviso modal va en after_idle: así la consola se
+        redibuja antes de que el diálogo bloquee el bucle de Tk.
+        """
+        self._exportando = False
+        if error:
+            self._log(f"Error exportando: {error}")
+            self.after_idle(messagebox.showerror, "Error", f"Error:\n{error}")
+            return
+        
+        if vacio:
+            self._log("Exportación cancelada: corte sin datos")
+            self.after_idle(messagebox.showwarning, "Vacío", "El corte no tiene datos para exportar")
+            return
+        
+        self._log(f"Exportado: {fn}")
+        self.after_idle(messagebox.showinfo, "✅", f"Exportado:\n{fn}")
+    
+    def _lotes_export(self, query, params, equipos):
+        """Lotes (columnas, filas) de una consulta de exportación, con el equipo ya resuelto.
+        
+        Cambia la última columna (id del equipo) por equipo_numero y equipo_integrantes. Todo
+        corre en el hilo de prefetch: el siguiente lote se lee y arma mientras se escribe el actual.
+        """
+        sin_equipo = (None, None)
+        
+        def resolver():
+            for cols, rows in self.db.stream_query(query, params):
+                yield (cols[:-1] + ('equipo_numero', 'equipo_integrantes'),
+                       [row[:-1] + equipos.get(row[-1], sin_equipo) for row in rows])
+        
+        return Utils.prefetch(resolver())
+    
+    def _escribir_hoja_excel(self, ws, fmt_header, lotes):
+        """Escribe una hoja a partir de lotes (columnas, filas); devuelve (columnas, filas escritas)"""
+        cols = ()
+        fila = 0
+        
+        for cols, rows in lotes:
+            if fila == 0:
+                ws.write_row(0, 0, cols, fmt_header)
+                fila = 1
+            for row in rows:
+                ws.write_row(fila, 0, row)
+                fila += 1
+        
+        return cols, max(fila - 1, 0)
+    
+    def _escribir_conteo_excel(self, wb, fmt_header, lotes):
+        """Escribe CONTEO_COMPLETO, DIFERENCIAS y PENDIENTES en una sola pasada por items_corte.
+        
+        En constant_memory cada hoja solo exige filas en orden, así que las tres se llenan a la vez.
+        Devuelve (hoja DIFERENCIAS, columnas, filas escritas en ella) para pintarla después.
+        """
+        ws_conteo = wb.add_worksheet("CONTEO_COMPLETO")
+        ws_dif = wb.add_worksheet("DIFERENCIAS")
+        ws_pend = wb.add_worksheet("PENDIENTES")
+        cols = ()
+        fila = fila_dif = fila_pend = 0
+        
+        for cols, rows in lotes:
+            if fila == 0:
+                i_conteo = cols.index('conteo_fisico')
+                i_dif = cols.index('diferencia')
+                # PENDIENTES lleva solo las columnas del item, sin las del equipo
+                n_item = cols.index('equipo_numero')
+                ws_conteo.write_row(0, 0, cols, fmt_header)
+                ws_dif.write_row(0, 0, cols, fmt_header)
+                ws_pend.write_row(0, 0, cols[:n_item], fmt_header)
+                fila = fila_dif = fila_pend = 1
             
-            if "DIFERENCIAS" in wb.sheetnames:
-                ws = wb["DIFERENCIAS"]
-                red = PatternFill(start_color="FF9999", fill_type="solid")
+            for row in rows:
+                ws_conteo.write_row(fila, 0, row)
+                fila += 1
                 
-                headers = [cell.value for cell in ws[1]]
-                if 'diferencia' in headers:
-                    idx_dif = headers.index('diferencia') + 1
-                    
-                    for row in ws.iter_rows(min_row=2):
-                        try:
-                            if float(row[idx_dif - 1].value or 0) != 0:
-                                for cell in row:
-                                    cell.fill = red
-                        except (ValueError, TypeError, AttributeError):
-                            pass
-            
-            wb.save(filename)
+                # Mismos criterios que las pestañas: conteo_fisico=0 / diferencia!=0 AND conteo_fisico>0
+                conteo = row[i_conteo]
+                if conteo == 0:
+                    ws_pend.write_row(fila_pend, 0, row[:n_item])
+                    fila_pend += 1
+                elif conteo is not None and conteo > 0 and row[i_dif] not in (None, 0):
+                    ws_dif.write_row(fila_dif, 0, row)
+                    fila_dif += 1
+        
+        return ws_dif, len(cols), max(fila_dif - 1, 0)
+    
+    def _pintar_diferencias_excel(self, wb, ws, n_cols, n_filas):
+        """Pinta las filas de la hoja DIFERENCIAS con un formato condicional (una regla, no celda a celda).
+        
+        La consulta ya filtra diferencia != 0, así que la regla es constante: no depende de la columna.
+        """
+        try:
+            if n_filas == 0:
+                return
+            
+            red = wb.add_format({'bg_color': '#FF9999'})
+            ws.conditional_format(1, 0, n_filas, n_cols - 1, {
+                'type': 'formula',
+                'criteria': '=TRUE',
+                'format': red
+            })
         except Exception as e:
-            logger.error(f"Error pintando Excel: {e}")
+            logger.error("Error pintando Excel: %s", e)
     
     # ========================================================================
     # CIERRE DE APLICACIÓN
@@ -2979,17 +4293,33 @@ class InventarioApp(ctk.CTk):
     
     def destroy(self):
         """Cierre controlado de la aplicación"""
+        # Un segundo WM_DELETE mientras se esperan los conteos encolados no hace nada
+        if self._cerrando.is_set():
+            return
         try:
-            # Detener sincronización
-            self.sync_running = False
-            if self.sync_thread and self.sync_thread.is_alive():
-                self.sync_thread.join(timeout=2)
+            # Los hilos dejan de publicar en Tk desde aquí
+            self._cerrando.set()
             
-            logger.info("Aplicación cerrada correctamente")
+            # Detener sincronización
+            for after_id in (self._sync_after_id, self._refresh_after_id):
+                if after_id:
+                    self.after_cancel(after_id)
+            # cancel_futures requiere Python 3.9 (mínimo documentado en el README)
+            self._sync_worker.shutdown(wait=False, cancel_futures=True)
+            self._sync_consultas.shutdown(wait=False, cancel_futures=True)
+            # Los conteos encolados sí se terminan de escribir antes de salir
+            self._guardado_worker.shutdown(wait=False)
         except Exception as e:
-            logger.error(f"Error al cerrar: {e}")
-        finally:
-            super().destroy()
+            logger.error("Error al cerrar: %s", e)
+        self._esperar_guardado()
+    
+    def _esperar_guardado(self):
+        """Sondea con after() hasta que termine el último guardado y destruye la ventana"""
+        if self._ultimo_guardado is not None and not self._ultimo_guardado.done():
+            self.after(50, self._esperar_guardado)
+            return
+        logger.info("Aplicación cerrada correctamente")
+        super().destroy()
 
 # ============================================================================
 # PUNTO DE ENTRADA
@@ -2999,6 +4329,6 @@ if __name__ == "__main__":
         app = InventarioApp()
         app.mainloop()
     except Exception as e:
-        logger.error(f"Error crítico en main: {e}")
+        logger.error("Error crítico en main: %s", e)
         messagebox.showerror("Error Crítico", f"Error al iniciar aplicación:\n{e}")
         sys.exit(1)
\ No newline at end of file